@@ -0,0 +1,251 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from recording import open_timeline
+from state_store import (channels, state_message, state_tag, handle_socket_message, DEFAULT_CHANNEL,
+                         CHANNEL_NAME, STREAM_QUEUE_SIZE, STREAM_KEEPALIVE)
+from urllib.parse import parse_qs
+import asyncio
+import contextvars
+import json
+import re
+
+try:
+    import uvicorn
+    from asgiref.sync import sync_to_async
+    from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+except ImportError:
+    uvicorn = None
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# asyncio server mode: /api/stream, /api/ws and replay stream clients are held on one event loop,
+# every other route is handed to the Flask app on a thread pool
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+class LoopBridge:
+    """
+    One channel subscriber for the whole event loop
+    A state change costs one thread-safe wake-up, the loop then fans the frame out to its clients
+    """
+    def __init__(self, loop, store):
+        self.loop = loop
+        self.store = store
+        self.clients = set()
+        store.subscribe(self)
+
+    def put_nowait(self, item):
+        # Never full, the fan-out below drops stale frames per client instead
+        self.loop.call_soon_threadsafe(self._fan_out, item)
+
+    def _fan_out(self, item):
+        for client in self.clients:
+            if client.full():
+                client.get_nowait()
+            client.put_nowait(item)
+
+    def connect(self):
+        client = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.clients.add(client)
+        return client
+
+    def disconnect(self, client):
+        self.clients.discard(client)
+        return not self.clients
+
+REPLAY_STREAM_PATH = re.compile(r'/api/replay/([^/]+)/([^/]+)/stream')
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def send_chunk(send, text):
+    await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+
+def query_float(scope, name, default):
+    """A float query parameter of the request, or default when it is missing or not a number"""
+    values = parse_qs(scope['query_string'].decode('latin-1')).get(name)
+    try:
+        return float(values[0]) if values else default
+    except ValueError:
+        return default
+
+if uvicorn:
+    class PooledWsgiToAsgi(WsgiToAsgi):
+        """
+        WsgiToAsgi running each request on a thread pool
+        asgiref runs them all on one shared thread, where a slow route would hold up every other one
+        """
+        def __init__(self, wsgi_application, executor):
+            super().__init__(wsgi_application)
+            self.executor = executor
+
+        async def __call__(self, scope, receive, send):
+            instance = WsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)
+            # The undecorated method, run on the pool instead of asgiref's thread-sensitive default
+            instance.run_wsgi_app = sync_to_async(partial(WsgiToAsgiInstance.run_wsgi_app.__wrapped__, instance),
+                                                  thread_sensitive=False, executor=self.executor)
+            await instance(scope, receive, send)
+
+def push_channel(path, endpoint):
+    """Channel name of /api/<endpoint> or /api/<channel>/<endpoint>, None for other paths"""
+    parts = path.strip('/').split('/')
+    if parts == ['api', endpoint]:
+        return DEFAULT_CHANNEL
+    if len(parts) == 3 and parts[0] == 'api' and parts[2] == endpoint:
+        return parts[1]
+    return None
+
+class OverlayServer:
+    """ASGI application serving the push endpoints natively and everything else through Flask"""
+    def __init__(self, flask_app, threads=32):
+        self.recordings_dir = flask_app.config['RECORDINGS_DIR']
+        self.wsgi = PooledWsgiToAsgi(flask_app, ThreadPoolExecutor(threads, thread_name_prefix='flask'))
+        # One bridge per channel with clients on this loop, dropped with its last client
+        # so the channel can go idle
+        self.bridges = {}
+
+    def connect(self, store):
+        bridge = self.bridges.get(store)
+        if bridge is None:
+            bridge = self.bridges[store] = LoopBridge(asyncio.get_running_loop(), store)
+        return bridge.connect()
+
+    def disconnect(self, store, client):
+        bridge = self.bridges.get(store)
+        if bridge and bridge.disconnect(client):
+            store.unsubscribe(bridge)
+            del self.bridges[store]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            channel = push_channel(scope['path'], 'stream')
+        elif scope['type'] == 'websocket':
+            channel = push_channel(scope['path'], 'ws')
+        else:
+            return
+        store = channels.get(channel) if channel else None
+        replay = REPLAY_STREAM_PATH.fullmatch(scope['path']) if scope['type'] == 'http' else None
+        timeline = None
+        if replay and CHANNEL_NAME.fullmatch(replay.group(1)):
+            timeline = await asyncio.get_running_loop().run_in_executor(
+                None, open_timeline, self.recordings_dir, replay.group(1), replay.group(2))
+
+        if scope['type'] == 'http' and store:
+            with store.connection('stream'):
+                await self.stream_state(store, receive, send)
+        elif timeline:
+            await self.replay_stream(timeline, timeline.start + query_float(scope, 't', 0.0), receive, send)
+        elif scope['type'] == 'websocket' and store:
+            with store.connection('websocket'):
+                await self.command_socket(store, receive, send)
+        elif scope['type'] == 'websocket':
+            await send({'type': 'websocket.close'})
+        else:
+            # Flask answers everything else, including 404 for unusable channel names
+            # asgiref copies its context variables back to the caller, and uvicorn would carry them
+            # into the next request on the connection, where they fail, so each one starts from a fresh context
+            await contextvars.Context().run(asyncio.ensure_future, self.wsgi(scope, receive, send))
+
+    async def stream_state(self, store, receive, send):
+        """Server-Sent Events stream, same frames as the Flask /api/stream route"""
+        client = self.connect(store)
+        disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+        next_frame = None
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+            current = store.current()
+            await send_chunk(send, f"retry: 1000\nid: {state_tag(current)}\ndata: {current.frame}\n\n")
+            while True:
+                if next_frame is None:
+                    next_frame = asyncio.ensure_future(client.get())
+                done, _ = await asyncio.wait({next_frame, disconnect}, timeout=STREAM_KEEPALIVE,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnect in done:
+                    break
+                if next_frame in done:
+                    snapshot = next_frame.result()
+                    next_frame = None
+                    await send_chunk(send, f"id: {state_tag(snapshot)}\ndata: {snapshot.frame}\n\n")
+                else:
+                    await send_chunk(send, ": keep-alive\n\n")
+        finally:
+            self.disconnect(store, client)
+            disconnect.cancel()
+            if next_frame is not None:
+                next_frame.cancel()
+
+    async def replay_stream(self, timeline, at, receive, send):
+        """Server-Sent Events playback, same frames as the Flask replay stream route"""
+        loop = asyncio.get_running_loop()
+        frames = timeline.frames(at)
+        disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+            started = loop.time()
+            while not disconnect.done():
+                # Records are read from disk, keep that off the event loop
+                frame = await loop.run_in_executor(None, next, frames, None)
+                if frame is None:
+                    await send_chunk(send, "event: end\ndata: \n\n")
+                    await send({'type': 'http.response.body', 'body': b''})
+                    break
+                recorded_at, version, data = frame
+                # Wait until the frame is due, keeping the connection alive through quiet stretches
+                while not disconnect.done():
+                    wait = (recorded_at - at) - (loop.time() - started)
+                    if wait <= 0:
+                        await send_chunk(send, f"event: replay\nid: {version}\ndata: {data}\n\n")
+                        break
+                    await asyncio.wait({disconnect}, timeout=min(wait, STREAM_KEEPALIVE))
+                    if wait > STREAM_KEEPALIVE:
+                        await send_chunk(send, ": keep-alive\n\n")
+        finally:
+            disconnect.cancel()
+
+    async def command_socket(self, store, receive, send):
+        """WebSocket command channel, same protocol as the Flask /api/ws route"""
+        if (await receive())['type'] != 'websocket.connect':
+            return
+        await send({'type': 'websocket.accept'})
+
+        send_lock = asyncio.Lock()
+
+        async def send_text(text):
+            async with send_lock:
+                await send({'type': 'websocket.send', 'text': text})
+
+        async def forward_state():
+            try:
+                while True:
+                    await send_text(state_message(await client.get()))
+            except Exception:
+                pass
+
+        client = self.connect(store)
+        loop = asyncio.get_running_loop()
+        await send_text(state_message(store.current()))
+        forwarder = asyncio.ensure_future(forward_state())
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                raw = message.get('text') or (message.get('bytes') or b'').decode()
+                # Commands take the store lock and may queue TTS, keep them off the event loop
+                ack = await loop.run_in_executor(None, handle_socket_message, store, raw)
+                await send_text(json.dumps(ack))
+        finally:
+            forwarder.cancel()
+            self.disconnect(store, client)
+
+def run(flask_app, host, port, threads=32, keep_alive=5, backlog=2048):
+    """Serve the app with uvicorn on a single event loop, Flask routes run on threads"""
+    if uvicorn is None:
+        raise SystemExit("The async server needs uvicorn and asgiref: pip install uvicorn[standard] asgiref")
+    uvicorn.run(OverlayServer(flask_app, threads), host=host, port=port, lifespan='off',
+                timeout_keep_alive=keep_alive, backlog=backlog)
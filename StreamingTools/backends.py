@@ -0,0 +1,394 @@
+from contextlib import contextmanager, nullcontext
+from threading import Lock, Thread
+import atexit
+import json
+import os
+import struct
+import tempfile
+import time
+import uuid
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import fcntl
+    from multiprocessing import shared_memory
+except ImportError:
+    fcntl = None  # Not available on Windows, where the production server runs a single process anyway
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# State backends: where channel state is kept and how other processes hear about changes
+
+class ChannelLimitError(RuntimeError):
+    """The backend has no room for another channel"""
+
+class MemoryBackend:
+    """
+    State lives only in this process, the StateStore's own lock is all the coordination needed
+    Every method is a no-op, this is the default backend
+    """
+    def lock(self, name):
+        return nullcontext()
+
+    def load(self, name):
+        """Return the shared (version, state, epoch) of a channel, or None when nothing is shared"""
+        return None
+
+    def save(self, name, version, state, frame, changes, epoch):
+        """Store a new version of a channel and tell the other processes about it"""
+
+    def newer(self, name, version):
+        """Return the shared (version, state, changes, epoch) of a channel if it is past version, else None"""
+        return None
+
+    def listen(self, registry):
+        """Start passing changes made by other processes to the registry's channels"""
+
+    def release(self, name):
+        """Let go of a channel this process has dropped"""
+
+class RedisBackend:
+    """
+    Channels shared by every process and host using the same Redis (or Redis-compatible) server
+    Updates hold a Redis lock per channel, so commands from different workers are applied one at a time,
+    and every saved version is published so the other processes can push it to their clients
+    """
+    LOCK_TIMEOUT = 5  # Seconds before a lock held by a crashed process expires
+
+    def __init__(self, url, prefix='redlix'):
+        if redis is None:
+            raise SystemExit("The Redis backend needs redis-py: pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.changes_channel = f'{prefix}:changes'
+        self.listener_thread = None
+        self.listener_lock = Lock()
+
+    @contextmanager
+    def lock(self, name):
+        """
+        Hold the channel's Redis lock, built from SET NX and a WATCH transaction instead of
+        Lua scripts so it also works on Redis-compatible servers without scripting
+        """
+        key = f'{self.prefix}:{name}:lock'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        while not self.client.set(key, token, nx=True, px=int(self.LOCK_TIMEOUT * 1000)):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Channel {name} is locked by another process")
+            time.sleep(0.002)
+        try:
+            yield
+        finally:
+            # Only delete the lock if it is still ours and did not expire into someone else's hands
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    if pipe.get(key) == token.encode():
+                        pipe.multi()
+                        pipe.delete(key)
+                        pipe.execute()
+                except redis.WatchError:
+                    pass
+
+    def load(self, name):
+        saved = self.client.get(f'{self.prefix}:{name}:state')
+        if saved is None:
+            return None
+        saved = json.loads(saved)
+        return saved['version'], saved['state'], saved.get('epoch')
+
+    def save(self, name, version, state, frame, changes, epoch):
+        pipe = self.client.pipeline()
+        pipe.set(f'{self.prefix}:{name}:state', f'{{"epoch": "{epoch}", "version": {version}, "state": {frame}}}')
+        pipe.publish(self.changes_channel, json.dumps(
+            {'channel': name, 'epoch': epoch, 'version': version, 'changes': changes, 'state': state}))
+        pipe.execute()
+
+    def listen(self, registry):
+        with self.listener_lock:
+            # Started in the serving process, a thread from before a fork would not be running
+            if not (self.listener_thread and self.listener_thread.is_alive()):
+                self.listener_thread = Thread(target=self._process_changes, args=(registry,), daemon=True)
+                self.listener_thread.start()
+
+    def release(self, name):
+        """Channels stay in Redis, where other processes and hosts may still use them"""
+
+    def newer(self, name, version):
+        """Changes arrive through the subscription, reads do not ask the server"""
+        return None
+
+    def _process_changes(self, registry):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.changes_channel)
+                # Changes published while not subscribed were missed, load what is current now
+                for store in list(registry.channels.values()):
+                    store.refresh()
+                for message in pubsub.listen():
+                    change = json.loads(message['data'])
+                    # Channels nobody here has opened load the current state when they are created
+                    store = registry.channels.get(change['channel'])
+                    if store:
+                        store.apply_remote(change['version'], change['state'], change['changes'], change.get('epoch'))
+            except Exception as e:
+                print(f"Error listening for Redis changes: {e}")
+                time.sleep(1)
+
+# Lock file layout, one byte each:
+#   0                       guards the slot names
+#   1 + slot                held by a writer of the slot
+#   1 + SHM_SLOTS + slot    shared by every process using the slot, the last one to let go frees it
+# Shared memory layout: SHM_SLOTS channel slots, each one
+#   name        32 bytes, the channel name, zero while the slot is free
+#   header      SHM_HEADER, guarded by the seq counter (odd while a writer is changing the slot)
+#   ring        SHM_RING_SIZE bytes of JSON payloads with every section that has no fixed layout
+SHM_SLOTS = 128
+SHM_NAME_SIZE = 32
+SHM_HEADER = struct.Struct('<QQ3d4dIII')  # seq, version, timer, countdown, flags, payload offset and length
+SHM_SEQ = struct.Struct('<Q')
+SHM_RING_OFFSET = 128  # Name and header, rounded up
+SHM_RING_SIZE = 96 * 1024
+SHM_SLOT_SIZE = SHM_RING_OFFSET + SHM_RING_SIZE
+# A payload of at most a third of the ring always fits beside the current one without touching it
+SHM_MAX_PAYLOAD = SHM_RING_SIZE // 3
+SHM_POLL_INTERVAL = 0.01  # Seconds between checks for versions saved by other workers
+
+# Flag bits of the header
+TIMER_RUNNING = 1
+TIMER_VISIBLE = 2
+COUNTDOWN_RUNNING = 4
+COUNTDOWN_VISIBLE = 8
+
+class SharedMemoryBackend:
+    """
+    Channels shared by the worker processes of one server through a shared memory block
+    Timers and flags have a fixed binary layout, messages and events are JSON in a ring buffer per channel
+    Readers copy a slot without any lock and retry if the seq counter shows a writer got in between,
+    writers take an fcntl lock on the channel's byte of a lock file
+    Create it before the server forks its workers, the block is removed when the creating process exits
+    The creating process claims the reserved channels right away, so they always have a slot
+    """
+    def __init__(self, reserved=()):
+        if fcntl is None:
+            raise SystemExit("The shared memory backend needs fcntl, which is not available on Windows")
+        self.owner = os.getpid()
+        self.memory = shared_memory.SharedMemory(name=f'redlix-{self.owner}', create=True,
+                                                 size=SHM_SLOTS * SHM_SLOT_SIZE)
+        self.buffer = self.memory.buf
+        # POSIX record locks belong to a process and are not inherited, so after a fork every worker
+        # locks for itself even though they share this file descriptor
+        self.lock_path = os.path.join(tempfile.gettempdir(), f'redlix-{self.owner}.lock')
+        # Opened for reading too, which shared locks need
+        self.lock_file = open(self.lock_path, 'w+b')
+        # Slots this process uses, a forked worker starts without any as it holds none of their locks
+        self.slots = {}
+        self.slots_lock = Lock()
+        os.register_at_fork(after_in_child=self.slots.clear)
+        self.listener_thread = None
+        self.listener_lock = Lock()
+        atexit.register(self.remove)
+        for name in reserved:
+            self._slot(name)
+
+    def remove(self):
+        # Forked workers run this too, only the creating process removes the block
+        if os.getpid() == self.owner:
+            self.buffer = None
+            self.memory.close()
+            self.memory.unlink()
+            os.remove(self.lock_path)
+
+    @contextmanager
+    def _file_lock(self, index):
+        fcntl.lockf(self.lock_file, fcntl.LOCK_EX, 1, index)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self.lock_file, fcntl.LOCK_UN, 1, index)
+
+    def _unused(self, base):
+        """True when no process uses the slot (caller holds byte 0 and does not use it either)"""
+        users = 1 + SHM_SLOTS + base // SHM_SLOT_SIZE
+        try:
+            fcntl.lockf(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, users)
+        except OSError:
+            return False
+        fcntl.lockf(self.lock_file, fcntl.LOCK_UN, 1, users)
+        return True
+
+    def _slot(self, name):
+        """Base offset of the channel's slot, taking a free one for a new channel"""
+        base = self.slots.get(name)
+        if base is not None:
+            return base
+        encoded = name.encode().ljust(SHM_NAME_SIZE, b'\0')
+        # Byte 0 of the lock file guards the slot names, threads of this process also need the thread lock
+        with self.slots_lock, self._file_lock(0):
+            base = self.slots.get(name)
+            if base is not None:
+                return base
+            free = None
+            # Locks of this process never conflict with each other, its own slots cannot be tested
+            own = set(self.slots.values())
+            for index in range(SHM_SLOTS):
+                slot = index * SHM_SLOT_SIZE
+                slot_name = bytes(self.buffer[slot:slot + SHM_NAME_SIZE])
+                if slot_name == encoded:
+                    base = slot
+                    break
+                # A slot left behind by processes that exited without letting go can be taken too
+                if free is None and slot not in own and (not slot_name.strip(b'\0') or self._unused(slot)):
+                    free = slot
+            else:
+                if free is None:
+                    raise ChannelLimitError(f"No free shared memory slot for channel {name}")
+                base = free
+                # A new channel starts from version 0 with an empty ring
+                self.buffer[base:base + SHM_RING_OFFSET] = encoded + bytes(SHM_RING_OFFSET - SHM_NAME_SIZE)
+            fcntl.lockf(self.lock_file, fcntl.LOCK_SH, 1, 1 + SHM_SLOTS + base // SHM_SLOT_SIZE)
+            self.slots[name] = base
+        return base
+
+    def release(self, name):
+        """Stop using a channel's slot, and free it if no other process uses it either"""
+        with self.slots_lock, self._file_lock(0):
+            base = self.slots.pop(name, None)
+            if base is None:
+                return
+            fcntl.lockf(self.lock_file, fcntl.LOCK_UN, 1, 1 + SHM_SLOTS + base // SHM_SLOT_SIZE)
+            if self._unused(base):
+                self.buffer[base:base + SHM_RING_OFFSET] = bytes(SHM_RING_OFFSET)
+
+    def _seq(self, base):
+        return SHM_SEQ.unpack_from(self.buffer, base + SHM_NAME_SIZE)[0]
+
+    @contextmanager
+    def lock(self, name):
+        base = self._slot(name)
+        with self._file_lock(1 + base // SHM_SLOT_SIZE):
+            seq = self._seq(base)
+            if seq & 1:
+                # A writer died halfway, let readers through again
+                SHM_SEQ.pack_into(self.buffer, base + SHM_NAME_SIZE, seq + 1)
+            yield
+
+    def _read(self, base):
+        """Return a consistent (version, header fields, payload) of a slot"""
+        while True:
+            seq = self._seq(base)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            fields = SHM_HEADER.unpack_from(self.buffer, base + SHM_NAME_SIZE)
+            if self._seq(base) != seq:
+                continue
+            offset, length = fields[-2:]
+            start = base + SHM_RING_OFFSET + offset
+            payload = bytes(self.buffer[start:start + length])
+            # The next write goes beside this payload, only a second one can overwrite it
+            if self._seq(base) <= seq + 2:
+                return fields[1], fields, payload
+
+    def _version(self, base):
+        """Version in a slot's header, read under the seq counter like a whole slot"""
+        while True:
+            seq = self._seq(base)
+            version = SHM_HEADER.unpack_from(self.buffer, base + SHM_NAME_SIZE)[1]
+            if not seq & 1 and self._seq(base) == seq:
+                return version
+            time.sleep(0)
+
+    def load(self, name):
+        saved = self.read(name)
+        return (saved[0], saved[1], saved[3]) if saved else None
+
+    def newer(self, name, version):
+        """
+        Return the channel's (version, state, changes, epoch) if another worker saved past version, else None
+        Checking costs one header read, so every read of a channel can do it before answering
+        """
+        # Only channels still open here, a dropped one must not claim its slot again
+        base = self.slots.get(name)
+        if base is None or self._version(base) <= version:
+            return None
+        return self.read(name)
+
+    def read(self, name):
+        """Return the channel's (version, state, changes, epoch), or None if nothing was saved"""
+        version, fields, payload = self._read(self._slot(name))
+        if not version:
+            return None
+        (_, _, timer_value, timer_started, timer_rate, countdown_value, countdown_started, countdown_rate,
+         countdown_initial, flags, _, _) = fields
+        saved = json.loads(payload)
+        state = saved['state']
+        state['timer'] = {
+            'base_value': timer_value,
+            'started_at': timer_started,
+            'rate': timer_rate,
+            'running': bool(flags & TIMER_RUNNING),
+            'visible': bool(flags & TIMER_VISIBLE),
+        }
+        state['countdown'] = {
+            'base_value': countdown_value,
+            'started_at': countdown_started,
+            'rate': countdown_rate,
+            'initial': countdown_initial,
+            'running': bool(flags & COUNTDOWN_RUNNING),
+            'visible': bool(flags & COUNTDOWN_VISIBLE),
+        }
+        return version, state, saved['changes'], saved.get('epoch')
+
+    def save(self, name, version, state, frame, changes, epoch):
+        """Write a new version of a channel (caller holds its lock)"""
+        base = self._slot(name)
+        timer, countdown = state['timer'], state['countdown']
+        payload = json.dumps({
+            'state': {section: fields for section, fields in state.items() if section not in ('timer', 'countdown')},
+            'changes': changes,
+            'epoch': epoch,
+        }).encode('utf-8')
+        if len(payload) > SHM_MAX_PAYLOAD:
+            raise ValueError("Messages and events are too large for shared memory")
+        flags = ((TIMER_RUNNING if timer['running'] else 0) | (TIMER_VISIBLE if timer['visible'] else 0) |
+                 (COUNTDOWN_RUNNING if countdown['running'] else 0) |
+                 (COUNTDOWN_VISIBLE if countdown['visible'] else 0))
+
+        seq, _, *_, offset, length = SHM_HEADER.unpack_from(self.buffer, base + SHM_NAME_SIZE)
+        offset += length
+        if offset + len(payload) > SHM_RING_SIZE:
+            offset = 0
+        SHM_SEQ.pack_into(self.buffer, base + SHM_NAME_SIZE, seq + 1)
+        start = base + SHM_RING_OFFSET + offset
+        self.buffer[start:start + len(payload)] = payload
+        SHM_HEADER.pack_into(self.buffer, base + SHM_NAME_SIZE, seq + 1, version,
+                             timer['base_value'], timer['started_at'], timer['rate'],
+                             countdown['base_value'], countdown['started_at'], countdown['rate'],
+                             countdown['initial'], flags, offset, len(payload))
+        SHM_SEQ.pack_into(self.buffer, base + SHM_NAME_SIZE, seq + 2)
+
+    def listen(self, registry):
+        with self.listener_lock:
+            if not (self.listener_thread and self.listener_thread.is_alive()):
+                self.listener_thread = Thread(target=self._process_changes, args=(registry,), daemon=True)
+                self.listener_thread.start()
+
+    def _process_changes(self, registry):
+        # Pushes changes to this worker's subscribers, reads catch up on their own through newer
+        # Reading a version is one memory access, so polling costs next to nothing
+        while True:
+            time.sleep(SHM_POLL_INTERVAL)
+            for name, store in list(registry.channels.items()):
+                try:
+                    saved = self.newer(name, store.snapshot.version)
+                    if saved:
+                        store.apply_remote(*saved)
+                except Exception as e:
+                    print(f"Error reading shared channel {name}: {e}")
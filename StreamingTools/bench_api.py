@@ -0,0 +1,306 @@
+from threading import Event, Thread
+import argparse
+import http.client
+import json
+import os
+import platform
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# API load test: N displays read the state while M operators send commands, against main.py
+# started locally in each server mode. Results are saved as JSON to compare versions
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODES = ['wsgi', 'async']
+STARTUP_TIMEOUT = 30
+# Operators alternate these, every one of them publishes a new state version
+COMMANDS = ['/api/timer/start', '/api/timer/stop']
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(mode, port, threads, push_clients, extra_args):
+    """Start main.py with profiling on, so lock contention can be read from /admin/profile"""
+    command = [sys.executable, os.path.join(BASE_DIR, 'main.py'), '--server', mode, '--port', str(port),
+               '--threads', str(threads), '--push-clients', str(push_clients), '--no-persistence',
+               '--profile'] + extra_args
+    # Own process group, so the Flask reloader child and gunicorn workers stop with it
+    # Windows has no process groups to signal, its servers (waitress, uvicorn) run in one process
+    process = subprocess.Popen(command, cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=hasattr(os, 'killpg'))
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"main.py --server {mode} exited with {process.returncode}")
+        try:
+            request(port, 'GET', '/api/state')
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise SystemExit(f"main.py --server {mode} did not answer within {STARTUP_TIMEOUT} seconds")
+
+def stop_server(process):
+    if not hasattr(os, 'killpg'):
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def request(port, method, path):
+    """One request on a new connection, returning (status, parsed JSON body)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        conn.request(method, path)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b'null')
+    finally:
+        conn.close()
+
+class Results:
+    """Latencies (seconds) and error count of one kind of client, shared by its threads"""
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.measuring = False  # Off during the warm-up
+
+    def add(self, latency):
+        if self.measuring:
+            self.latencies.append(latency)  # list.append is atomic, no lock needed
+
+    def error(self):
+        if self.measuring:
+            self.errors += 1
+
+    def summary(self, duration):
+        values = sorted(self.latencies)
+        return {
+            'count': len(values),
+            'errors': self.errors,
+            'throughput': len(values) / duration,
+            'p50_ms': percentile(values, 50) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'max_ms': (values[-1] if values else 0.0) * 1000,
+        }
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+def poll_display(port, stop, results, interval):
+    """A display polling /api/state with its last ETag, like the pages do without a stream"""
+    conn, etag = None, None
+    while not stop.is_set():
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            started = time.perf_counter()
+            conn.request('GET', '/api/state', headers={'If-None-Match': etag} if etag else {})
+            response = conn.getresponse()
+            response.read()
+            if response.status not in (200, 304):
+                raise OSError(f"HTTP {response.status}")
+            results.add(time.perf_counter() - started)
+            etag = response.getheader('ETag', etag)
+        except (OSError, http.client.HTTPException):
+            results.error()
+            if conn:
+                conn.close()
+            conn = None
+            time.sleep(0.1)
+        if interval:
+            stop.wait(interval)
+    if conn:
+        conn.close()
+
+def stream_display(port, stop, results, interval):
+    """
+    A display subscribed to /api/stream. Server and client share the clock here, so the push
+    latency of a timer change is the time it arrives minus the timer's started_at
+    """
+    while not stop.is_set():
+        # Streams send a keep-alive comment at least every 15 seconds
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        try:
+            conn.request('GET', '/api/stream')
+            response = conn.getresponse()
+            started_at = None
+            while not stop.is_set():
+                line = response.readline()
+                if not line:
+                    raise OSError("Stream closed")
+                if line.startswith(b'data: '):
+                    received = time.time()
+                    timer = json.loads(line[6:])['timer']
+                    # The first frame is the state on connect, not a change
+                    if started_at is not None and timer['started_at'] != started_at:
+                        results.add(received - timer['started_at'])
+                    started_at = timer['started_at']
+        except (OSError, ValueError, http.client.HTTPException):
+            results.error()
+            time.sleep(0.1)
+        finally:
+            conn.close()
+
+def operator(port, stop, results, interval):
+    """An operator sending commands back to back, or every interval seconds"""
+    conn, count = None, 0
+    while not stop.is_set():
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            started = time.perf_counter()
+            conn.request('POST', COMMANDS[count % len(COMMANDS)])
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                raise OSError(f"HTTP {response.status}")
+            results.add(time.perf_counter() - started)
+            count += 1
+        except (OSError, http.client.HTTPException):
+            results.error()
+            if conn:
+                conn.close()
+            conn = None
+            time.sleep(0.1)
+        if interval:
+            stop.wait(interval)
+    if conn:
+        conn.close()
+
+def lock_contention(port):
+    """Channel lock wait and hold time per route from the server's profiler"""
+    _, routes = request(port, 'GET', '/admin/profile')
+    return {
+        'wait_seconds': sum(route['lock_wait_seconds'] for route in routes),
+        'hold_seconds': sum(route['lock_hold_seconds'] for route in routes),
+        'routes': {route['route']: {'lock_wait_seconds': route['lock_wait_seconds'],
+                                    'lock_hold_seconds': route['lock_hold_seconds']}
+                   for route in routes if route['lock_wait_seconds'] or route['lock_hold_seconds']},
+    }
+
+def run_mode(mode, args):
+    port = free_port()
+    # Every open stream holds a thread in the WSGI servers
+    threads = args.displays + args.operators + 4
+    print(f"{mode}: starting main.py on port {port}")
+    process = start_server(mode, port, threads, args.displays, shlex.split(args.server_args))
+    try:
+        displays, operators = Results(), Results()
+        display = stream_display if args.push == 'stream' else poll_display
+        stop = Event()
+        clients = [Thread(target=display, args=(port, stop, displays, args.poll_interval), daemon=True)
+                   for _ in range(args.displays)]
+        clients += [Thread(target=operator, args=(port, stop, operators, args.command_interval), daemon=True)
+                    for _ in range(args.operators)]
+        for client in clients:
+            client.start()
+
+        time.sleep(args.warmup)
+        request(port, 'DELETE', '/admin/profile')
+        displays.measuring = operators.measuring = True
+        started = time.perf_counter()
+        time.sleep(args.duration)
+        displays.measuring = operators.measuring = False
+        duration = time.perf_counter() - started
+        locks = lock_contention(port)
+
+        stop.set()
+    finally:
+        stop_server(process)
+    # Open streams end with the server
+    for client in clients:
+        client.join(timeout=5)
+
+    result = {
+        'displays': displays.summary(duration),
+        'commands': operators.summary(duration),
+        'locks': locks,
+    }
+    reads = result['displays']
+    commands = result['commands']
+    label = 'push latency' if args.push == 'stream' else 'reads'
+    print(f"{mode}: {label} {reads['throughput']:.0f}/s p50 {reads['p50_ms']:.2f} ms p99 {reads['p99_ms']:.2f} ms, "
+          f"commands {commands['throughput']:.0f}/s p50 {commands['p50_ms']:.2f} ms p99 {commands['p99_ms']:.2f} ms, "
+          f"lock wait {locks['wait_seconds'] * 1000:.1f} ms, errors {reads['errors'] + commands['errors']}")
+    return result
+
+def compare(results, baseline_path):
+    """Print how throughput and p99 latency moved against an earlier result file"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    for mode, result in results['modes'].items():
+        before = baseline.get('modes', {}).get(mode)
+        if not before:
+            continue
+        for kind in ('displays', 'commands'):
+            for key in ('throughput', 'p99_ms'):
+                old, new = before[kind][key], result[kind][key]
+                change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+                print(f"{mode} {kind} {key}: {old:.2f} -> {new:.2f} ({change})")
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='REDLIX Streaming Tools API load test')
+    parser.add_argument('--modes', nargs='+', default=DEFAULT_MODES, choices=['wsgi', 'async', 'dev'],
+                        help='Server modes to test, each with a fresh main.py')
+    parser.add_argument('--displays', type=int, default=20, help='Simulated display clients')
+    parser.add_argument('--operators', type=int, default=2, help='Simulated control panels sending commands')
+    parser.add_argument('--push', choices=['poll', 'stream'], default='poll',
+                        help="'poll' displays read /api/state, 'stream' displays subscribe to /api/stream")
+    parser.add_argument('--poll-interval', type=float, default=0,
+                        help='Seconds between two polls of a display, 0 for back to back')
+    parser.add_argument('--command-interval', type=float, default=0,
+                        help='Seconds between two commands of an operator, 0 for back to back')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds measured per mode')
+    parser.add_argument('--warmup', type=float, default=2, help='Seconds of load before measuring')
+    parser.add_argument('--server-args', default='', help="More main.py options, e.g. \"--workers 2 --backend shm\"")
+    parser.add_argument('--output', help='Result file (default bench-results/api-<time>.json)')
+    parser.add_argument('--baseline', help='Earlier result file to compare with')
+    args = parser.parse_args()
+
+    results = {
+        'benchmark': 'api',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'modes': {mode: run_mode(mode, args) for mode in args.modes},
+    }
+
+    output = args.output or os.path.join(BASE_DIR, 'bench-results', f"api-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+from bench_api import git_commit, percentile
+from pydub import AudioSegment
+from pydub.utils import which
+from threading import Event, Lock
+from tts import TTSManager, decode_mp3
+import argparse
+import json
+import os
+import platform
+import time
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# TTS pipeline benchmark: time from speak to the first audio sample, the cost of each stage and
+# messages per second under a burst, with a local stand-in for Google TTS and a silent audio sink
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ['clean', 'detect', 'cache', 'synthesize', 'decode', 'play']
+CACHE_BYTES = 64 * 2**20
+# Chat-like texts in the languages the overlay sees, emojis included for the cleaning stage
+TEXTS = [
+    "Thanks for the follow, welcome to the stream! 🎉",
+    "Merci beaucoup pour le raid, vous êtes incroyables 🔥",
+    "Danke für das Abo, viel Spaß beim Zuschauen",
+    "Gracias por la donación, eres el mejor ⭐",
+    "Next round starts in five minutes, grab a drink 🥤",
+    "Attention, le boss arrive dans trente secondes ⚠️",
+]
+
+# A silent MPEG-1 Layer III frame: 128 kbit/s, 44.1 kHz, mono, empty side info, 1152 samples
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC4]) + bytes(413)
+MP3_FRAME_SECONDS = 1152 / 44100
+SPEECH_SECONDS_PER_CHAR = 0.06  # About how long Google TTS takes to say one character
+
+class FakeSynthesizer:
+    """Stands in for Google TTS: waits like a network round trip, then returns silent MP3 of speech length"""
+    def __init__(self, delay):
+        self.delay = delay
+
+    def __call__(self, text, lang, tld):
+        if self.delay:
+            time.sleep(self.delay)
+        frames = max(1, round(len(text) * SPEECH_SECONDS_PER_CHAR / MP3_FRAME_SECONDS))
+        return MP3_FRAME * frames
+
+def fake_decode(mp3):
+    """Decoder used without ffmpeg, a silent segment as long as the MP3's frames"""
+    frames = len(mp3) // len(MP3_FRAME)
+    return AudioSegment.silent(duration=frames * MP3_FRAME_SECONDS * 1000)
+
+class NullSink:
+    """Takes the decoded audio instead of a sound card and notes when each text got there"""
+    def __init__(self):
+        self.arrivals = []
+        self.failures = []
+        self.lock = Lock()
+        self.arrived = Event()
+
+    def __call__(self, audio):
+        with self.lock:
+            self.arrivals.append(time.perf_counter())
+            self.arrived.set()
+
+    def fail(self, text, error):
+        """Failure hook of the TTSManager, a text that never reaches the sink ends the benchmark"""
+        with self.lock:
+            self.failures.append(str(error))
+            self.arrived.set()
+
+    def wait_for(self, count, timeout):
+        deadline = time.monotonic() + timeout
+        while len(self.arrivals) < count:
+            if self.failures:
+                raise SystemExit(f"TTS failed: {self.failures[0]}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SystemExit(f"TTS produced {len(self.arrivals)} of {count} texts within {timeout} seconds")
+            self.arrived.wait(remaining)
+            self.arrived.clear()
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean_ms': sum(values) / len(values) * 1000 if values else 0.0,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': (values[-1] if values else 0.0) * 1000,
+    }
+
+def build_manager(args, decoder):
+    sink = NullSink()
+    manager = TTSManager(synthesizer=FakeSynthesizer(args.synth_delay), decoder=decoder, player=sink)
+    if args.cache or args.cache_dir or args.decoded_cache:
+        # The texts repeat, so after the first round every one is a hit
+        manager.enable_cache(CACHE_BYTES, args.cache_dir, CACHE_BYTES, CACHE_BYTES if args.decoded_cache else 0)
+    stages = {stage: [] for stage in STAGES}
+    manager.stage_hooks.append(lambda stage, seconds: stages[stage].append(seconds))
+    manager.failure_hooks.append(sink.fail)
+    return manager, sink, stages
+
+def measure_latency(args, decoder):
+    """Speak texts one at a time, from speak_async to the audio reaching the sink"""
+    manager, sink, stages = build_manager(args, decoder)
+    # The first text loads the langdetect profiles, keep it out of the numbers
+    manager.speak_async(TEXTS[0])
+    sink.wait_for(1, args.timeout)
+    for samples in stages.values():
+        samples.clear()
+
+    latencies = []
+    for i in range(args.messages):
+        started = time.perf_counter()
+        manager.speak_async(TEXTS[i % len(TEXTS)])
+        sink.wait_for(i + 2, args.timeout)
+        latencies.append(sink.arrivals[-1] - started)
+    manager.stop()
+    return {
+        'time_to_first_audio': summarize(latencies),
+        'stages': {stage: summarize(samples) for stage, samples in stages.items()},
+    }
+
+def measure_burst(args, decoder):
+    """Queue a burst of texts at once and time until the last one reaches the sink"""
+    manager, sink, _ = build_manager(args, decoder)
+    manager.speak_async(TEXTS[0])
+    sink.wait_for(1, args.timeout)
+
+    started = time.perf_counter()
+    for i in range(args.burst):
+        manager.speak_async(TEXTS[i % len(TEXTS)])
+    sink.wait_for(args.burst + 1, args.timeout)
+    elapsed = time.perf_counter() - started
+    manager.stop()
+    return {
+        'messages': args.burst,
+        'seconds': elapsed,
+        'messages_per_second': args.burst / elapsed,
+    }
+
+def compare(results, baseline_path):
+    """Print how the latencies and the burst rate moved against an earlier result file"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    pairs = [('time_to_first_audio p50_ms', lambda r: r['latency']['time_to_first_audio']['p50_ms']),
+             ('time_to_first_audio p99_ms', lambda r: r['latency']['time_to_first_audio']['p99_ms']),
+             ('burst messages_per_second', lambda r: r['burst']['messages_per_second'])]
+    pairs += [(f'stage {stage} p50_ms', lambda r, stage=stage: r['latency']['stages'][stage]['p50_ms'])
+              for stage in STAGES]
+    for name, value in pairs:
+        try:
+            old, new = value(baseline), value(results)
+        except KeyError:
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+        print(f"{name}: {old:.2f} -> {new:.2f} ({change})")
+
+def main():
+    parser = argparse.ArgumentParser(description='REDLIX Streaming Tools TTS pipeline benchmark')
+    parser.add_argument('--messages', type=int, default=50, help='Texts spoken one at a time for the latencies')
+    parser.add_argument('--burst', type=int, default=200, help='Texts queued at once for the throughput')
+    parser.add_argument('--synth-delay', type=float, default=0.0,
+                        help='Seconds the fake synthesizer waits per text, e.g. 0.3 for a Google TTS round trip')
+    parser.add_argument('--cache', action='store_true', help='Cache synthesized texts in memory, as main.py does')
+    parser.add_argument('--cache-dir', help='Also cache them on disk in this directory')
+    parser.add_argument('--decoded-cache', action='store_true', help='Also keep their decoded audio, skipping the decode')
+    parser.add_argument('--fake-decode', action='store_true',
+                        help='Skip the MP3 decode (used anyway when ffmpeg or ffprobe is missing)')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds to wait for the audio of a run')
+    parser.add_argument('--output', help='Result file (default bench-results/tts-<time>.json)')
+    parser.add_argument('--baseline', help='Earlier result file to compare with')
+    args = parser.parse_args()
+
+    decoder = decode_mp3
+    # pydub reads MP3 through ffmpeg and ffprobe (or their libav counterparts)
+    if args.fake_decode or not ((which('ffmpeg') or which('avconv')) and (which('ffprobe') or which('avprobe'))):
+        if not args.fake_decode:
+            print("ffmpeg or ffprobe not found, the decode stage is skipped")
+        decoder = fake_decode
+
+    results = {
+        'benchmark': 'tts',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'decoder': 'pydub' if decoder is decode_mp3 else 'skipped',
+        'latency': measure_latency(args, decoder),
+        'burst': measure_burst(args, decoder),
+    }
+
+    latency = results['latency']
+    first_audio = latency['time_to_first_audio']
+    print(f"time to first audio: p50 {first_audio['p50_ms']:.2f} ms, p99 {first_audio['p99_ms']:.2f} ms")
+    for stage, stats in latency['stages'].items():
+        if not stats['count']:
+            continue
+        print(f"  {stage:<10} mean {stats['mean_ms']:8.3f} ms  p50 {stats['p50_ms']:8.3f} ms  "
+              f"p99 {stats['p99_ms']:8.3f} ms")
+    print(f"burst: {results['burst']['messages_per_second']:.1f} messages/s")
+
+    output = args.output or os.path.join(BASE_DIR, 'bench-results', f"tts-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+if __name__ == '__main__':
+    main()
@@ -1,54 +1,83 @@
-from flask import Flask, jsonify, request, render_template_string, send_from_directory
-from threading import Lock
+from flask import Flask, Response, abort, jsonify, request, render_template_string, send_from_directory
+from functools import wraps
+from threading import Lock, Thread
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import queue
+import re
+import socket
 import time
-from tts import speak
+from state_store import (channels, offer, state_message, state_tag, handle_socket_message, STREAM_KEEPALIVE,
+                         DEFAULT_CHANNEL, CHANNEL_NAME, apply_timer, apply_countdown, apply_visibility, apply_message,
+                         apply_skip_message, apply_clear_message, apply_event, apply_clear_events,
+                         apply_batch)
+from recording import list_sessions, open_timeline
+from tts import tts_manager
+import metrics
 import os
 
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None  # WebSocket channel is optional, the pages fall back to /api/stream
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Pages are then only served gzip compressed
+
 app = Flask(__name__)
-lock = Lock()
+sock = Sock(app) if Sock else None
 
 # Get the directory where main.py is located
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+app.config['RECORDINGS_DIR'] = os.path.join(BASE_DIR, 'recordings')
 
 # REDLIX
 ## Streaming Tools Alpha v.1.0
 # This main.py Controls the Web Interface and all the Effects for StreamingTools
 # As of 30.10.2025
 
-# Global state with default values
-state = {
-    "timer": {
-        "value": 0.0,
-        "running": False,
-        "visible": True,
-        "last_update": time.time()
-    },
-    "countdown": {
-        "value": 0.0,
-        "initial": 0.0,
-        "running": False,
-        "visible": True,
-        "last_update": time.time()
-    },
-    "message": {
-        "text": "",
-        "color": "#b71c1c",
-        "expires_at": 0.0
-    },
-    "event": {
-        "type": "",
-        "expires_at": 0.0
-    }
-}
-
 CONTROL_HTML = """
 <!DOCTYPE html>
 <html>
 <head>
     <meta charset="utf-8"/>
     <title>REDLIX | Streaming Tools Alpha v.1.0</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
+    <link rel="preload" href="{{ media_url('fonts/Inter-Regular.woff2') }}" as="font" type="font/woff2" crossorigin>
+    <link rel="preload" href="{{ media_url('fonts/Inter-Medium.woff2') }}" as="font" type="font/woff2" crossorigin>
+    <link rel="preload" href="{{ media_url('fonts/Inter-SemiBold.woff2') }}" as="font" type="font/woff2" crossorigin>
+    <link rel="preload" href="{{ media_url('fonts/Inter-Bold.woff2') }}" as="font" type="font/woff2" crossorigin>
     <style>
+        /* Fonts are served from media/fonts, so the overlay does not depend on an internet connection */
+        @font-face {
+            font-family: 'Inter';
+            font-weight: 400;
+            font-display: block;
+            src: url("{{ media_url('fonts/Inter-Regular.woff2') }}") format('woff2');
+        }
+        @font-face {
+            font-family: 'Inter';
+            font-weight: 500;
+            font-display: block;
+            src: url("{{ media_url('fonts/Inter-Medium.woff2') }}") format('woff2');
+        }
+        @font-face {
+            font-family: 'Inter';
+            font-weight: 600;
+            font-display: block;
+            src: url("{{ media_url('fonts/Inter-SemiBold.woff2') }}") format('woff2');
+        }
+        @font-face {
+            font-family: 'Inter';
+            font-weight: 700;
+            font-display: block;
+            src: url("{{ media_url('fonts/Inter-Bold.woff2') }}") format('woff2');
+        }
+
         :root {
             --primary-red: rgb(128, 26, 48);
             --dark-gray: rgb(38, 38, 38);
@@ -159,6 +188,12 @@ CONTROL_HTML = """
             gap: 0.5rem;
         }
 
+        .queue-count {
+            font-size: 0.875rem;
+            font-weight: 500;
+            color: var(--dark-gray);
+        }
+
         h2::before {
             content: '';
             display: block;
@@ -462,7 +497,7 @@ CONTROL_HTML = """
         <div class="header">
             <div class="header-left">
                 <div class="header-logo">
-                    <img src="media/headerlogo.png" alt="REDLIX Streaming Tools Logo">
+                    <img src="{{ media_url('headerlogo.png') }}" alt="REDLIX Streaming Tools Logo">
                 </div>
                 <h1 class="header-title">STREAMING TOOLS</h1>
             </div>
@@ -531,6 +566,7 @@ CONTROL_HTML = """
             <div class="panel panel-full">
                 <div class="panel-header">
                     <h2>Message</h2>
+                    <span id="messageQueue" class="queue-count"></span>
                 </div>
                 <div class="message-controls">
                     <select id="messageEmoji">
@@ -551,8 +587,13 @@ CONTROL_HTML = """
                         <option value="30">30s</option>
                         <option value="60">60s</option>
                     </select>
+                    <select id="messagePriority">
+                        <option value="0" selected>Normal</option>
+                        <option value="1">High</option>
+                    </select>
                     <input type="color" id="messageColor" value="#b71c1c">
                     <button onclick="sendMessage()" class="start">Show</button>
+                    <button onclick="skipMessage()">Skip</button>
                     <button onclick="clearMessage()">Clear</button>
                 </div>
             </div>
@@ -578,7 +619,7 @@ CONTROL_HTML = """
         <div class="footer">
             <div class="footer-left">
                 <div class="footer-logo">
-                    <img src="media/redlixlogo.svg" alt="REDLIX Logo">
+                    <img src="{{ media_url('redlixlogo.svg') }}" alt="REDLIX Logo">
                 </div>
                 <div class="footer-info">
                     <div class="footer-title">REDLIX STREAMING TOOLS</div>
@@ -613,25 +654,147 @@ CONTROL_HTML = """
             return `${h.toString().padStart(2,'0')}:${m.toString().padStart(2,'0')}:${s.toString().padStart(2,'0')}`;
         }
 
-        async function updateState() {
+        // /control/<channel> and /display/<channel> use /api/<channel>, the plain pages the default channel
+        const channel = location.pathname.split('/')[2];
+        const API_BASE = channel ? `/api/${channel}` : '/api';
+
+        let latestState = null;
+        let stateVersion = -1;
+        let stateEpoch = '';
+        let streamOpen = false;
+        let pollTimer = null;
+
+        // Timers are computed locally from the start anchor the server publishes
+        function currentValue(part) {
+            const value = part.base_value + part.rate * (Date.now() / 1000 - part.started_at);
+            return Math.max(0, value);
+        }
+
+        function updateState() {
+            if (!latestState) return;
+            const data = latestState;
+            
+            document.getElementById('timerStatus').textContent = formatTime(currentValue(data.timer));
+            document.getElementById('countdownStatus').textContent = formatTime(currentValue(data.countdown));
+            
+            document.getElementById('timerVisibility').classList.toggle('active', data.timer.visible);
+            document.getElementById('countdownVisibility').classList.toggle('active', data.countdown.visible);
+
+            const queued = data.message.queue.length;
+            document.getElementById('messageQueue').textContent = queued ? `${queued} queued` : '';
+        }
+
+        function applyState(data, version, epoch) {
+            latestState = data;
+            stateVersion = version;
+            stateEpoch = epoch;
+            updateState();
+        }
+
+        // Apply an /api/state?since= answer, which is either a full state or the changed fields
+        function applyDelta(body) {
+            if (body.full) {
+                applyState(body.state, body.version, body.epoch);
+                return;
+            }
+            const merged = Object.assign({}, latestState);
+            for (const [section, fields] of Object.entries(body.changes)) {
+                merged[section] = Object.assign({}, merged[section], fields);
+            }
+            applyState(merged, body.version, body.epoch);
+        }
+
+        // Polling fallback while /api/stream is unavailable
+        async function pollState() {
             try {
-                const response = await fetch('/api/state');
-                const data = await response.json();
-                
-                document.getElementById('timerStatus').textContent = formatTime(data.timer.value);
-                document.getElementById('countdownStatus').textContent = formatTime(data.countdown.value);
-                
-                document.getElementById('timerVisibility').classList.toggle('active', data.timer.visible);
-                document.getElementById('countdownVisibility').classList.toggle('active', data.countdown.visible);
+                const response = await fetch(`${API_BASE}/state?since=${stateVersion}&epoch=${stateEpoch}`);
+                applyDelta(await response.json());
             } catch (err) {
                 console.error('Failed to update state:', err);
             }
-            setTimeout(updateState, 100);
+            pollTimer = streamOpen ? null : setTimeout(pollState, 100);
+        }
+
+        function startPolling() {
+            if (pollTimer === null) {
+                pollTimer = setTimeout(pollState, 0);
+            }
+        }
+
+        function connectStream() {
+            if (!window.EventSource) {
+                startPolling();
+                return;
+            }
+            const source = new EventSource(`${API_BASE}/stream`);
+            source.onopen = () => {
+                streamOpen = true;
+                clearTimeout(pollTimer);
+                pollTimer = null;
+            };
+            source.onmessage = (event) => {
+                // Frame ids are <epoch>-<version>
+                const [epoch, version] = event.lastEventId.split('-');
+                applyState(JSON.parse(event.data), parseInt(version), epoch);
+            };
+            source.onerror = () => {
+                streamOpen = false;
+                source.close();
+                startPolling();
+                setTimeout(connectStream, 5000);
+            };
+        }
+
+        // WebSocket channel for commands and state; the SSE stream is the fallback
+        let socket = null;
+        let commandId = 0;
+        const pendingCommands = new Map();
+
+        function connectSocket() {
+            if (!window.WebSocket) {
+                connectStream();
+                return;
+            }
+            const scheme = location.protocol === 'https:' ? 'wss:' : 'ws:';
+            const ws = new WebSocket(`${scheme}//${location.host}${API_BASE}/ws`);
+            let opened = false;
+            ws.onopen = () => {
+                opened = true;
+                socket = ws;
+            };
+            ws.onmessage = (event) => {
+                const message = JSON.parse(event.data);
+                if (message.type === 'state') {
+                    applyState(message.state, message.version, message.epoch);
+                } else if (message.type === 'ack') {
+                    const resolve = pendingCommands.get(message.id);
+                    pendingCommands.delete(message.id);
+                    if (!message.success) console.error('Command failed:', message.error);
+                    if (resolve) resolve(message);
+                }
+            };
+            ws.onclose = () => {
+                socket = null;
+                pendingCommands.forEach((resolve) => resolve(null));
+                pendingCommands.clear();
+                if (opened) {
+                    setTimeout(connectSocket, 1000);
+                } else {
+                    connectStream();
+                }
+            };
         }
 
         async function apiCall(endpoint, method='POST', data={}) {
+            if (socket && method === 'POST') {
+                const id = ++commandId;
+                return new Promise((resolve) => {
+                    pendingCommands.set(id, resolve);
+                    socket.send(JSON.stringify({id, command: endpoint, data}));
+                });
+            }
             try {
-                const response = await fetch(`/api/${endpoint}`, {
+                const response = await fetch(`${API_BASE}/${endpoint}`, {
                     method,
                     headers: {'Content-Type': 'application/json'},
                     body: JSON.stringify(data)
@@ -668,8 +831,13 @@ CONTROL_HTML = """
             const emoji = document.getElementById('messageEmoji').value;
             const color = document.getElementById('messageColor').value;
             const duration = document.getElementById('messageDuration').value;
+            const priority = document.getElementById('messagePriority').value;
             const fullText = emoji ? `${emoji} ${text} ${emoji}` : text;
-            apiCall('message', 'POST', {text: fullText, color, duration});
+            apiCall('message', 'POST', {text: fullText, color, duration, priority});
+        }
+
+        function skipMessage() {
+            apiCall('message/skip');
         }
 
         function clearMessage() {
@@ -681,7 +849,10 @@ CONTROL_HTML = """
             apiCall('event', 'POST', {type, duration});
         }
 
-        window.onload = updateState;
+        window.onload = () => {
+            connectSocket();
+            setInterval(updateState, 100);
+        };
     </script>
 </body>
 </html>
@@ -693,8 +864,38 @@ DISPLAY_HTML = """
 <head>
     <meta charset="utf-8"/>
     <title>Stream Display for OBS v.1.0 / PART OF STREAMING TOOLS REDLIX</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600;700&family=JetBrains+Mono:wght@700&display=swap" rel="stylesheet">
+    <link rel="preload" href="{{ media_url('fonts/Inter-Regular.woff2') }}" as="font" type="font/woff2" crossorigin>
+    <link rel="preload" href="{{ media_url('fonts/Inter-SemiBold.woff2') }}" as="font" type="font/woff2" crossorigin>
+    <link rel="preload" href="{{ media_url('fonts/Inter-Bold.woff2') }}" as="font" type="font/woff2" crossorigin>
+    <link rel="preload" href="{{ media_url('fonts/JetBrainsMono-Bold-digits.woff2') }}" as="font" type="font/woff2" crossorigin>
     <style>
+        /* Fonts are served from media/fonts, so the overlay does not depend on an internet connection */
+        @font-face {
+            font-family: 'Inter';
+            font-weight: 400;
+            font-display: block;
+            src: url("{{ media_url('fonts/Inter-Regular.woff2') }}") format('woff2');
+        }
+        @font-face {
+            font-family: 'Inter';
+            font-weight: 600;
+            font-display: block;
+            src: url("{{ media_url('fonts/Inter-SemiBold.woff2') }}") format('woff2');
+        }
+        @font-face {
+            font-family: 'Inter';
+            font-weight: 700;
+            font-display: block;
+            src: url("{{ media_url('fonts/Inter-Bold.woff2') }}") format('woff2');
+        }
+        /* Only the digits and the colon, which is all the timer and countdown show */
+        @font-face {
+            font-family: 'Timer Digits';
+            font-weight: 700;
+            font-display: block;
+            src: url("{{ media_url('fonts/JetBrainsMono-Bold-digits.woff2') }}") format('woff2');
+            unicode-range: U+0030-003A;
+        }
         body {
             margin: 0;
             padding: 30px;
@@ -755,7 +956,7 @@ DISPLAY_HTML = """
             transform: translateY(-50%);
         }
         .time-display {
-            font-family: 'JetBrains Mono', monospace;
+            font-family: 'Timer Digits', monospace;
             font-size: 42px;
             font-weight: 700;
             display: flex;
@@ -1355,8 +1556,10 @@ DISPLAY_HTML = """
             groups[2].textContent = s;
         }
 
-        let currentEvent = null;
-        let eventEndTime = 0;
+        // Ids of the events this display has played or missed, so each one plays once
+        const playedEvents = new Set();
+        // Stop functions of the effects started here, by event id
+        const playingEffects = new Map();
         
         function createConfetti() {
             const colors = ['#ff0000', '#00ff00', '#0000ff', '#ffff00', '#ff00ff', '#00ffff', '#ffa500', '#ff1493'];
@@ -1374,9 +1577,9 @@ DISPLAY_HTML = """
             setTimeout(() => confetti.remove(), 5000);
         }
         
-        function startConfetti() {
+        function startConfetti(endTime) {
             const interval = setInterval(() => {
-                if (Date.now() / 1000 > eventEndTime) {
+                if (clockNow() > endTime) {
                     clearInterval(interval);
                     return;
                 }
@@ -1384,9 +1587,10 @@ DISPLAY_HTML = """
                     createConfetti();
                 }
             }, 100);
+            return () => clearInterval(interval);
         }
         
-        function createExplosion() {
+        function createExplosion(endTime) {
             // Create explosion container
             const container = document.createElement('div');
             container.className = 'explosion-container';
@@ -1551,93 +1755,232 @@ DISPLAY_HTML = """
             }
             
             // Cleanup after explosion
-            const cleanupTime = (eventEndTime - Date.now() / 1000) * 1000;
-            setTimeout(() => {
+            const stop = () => {
                 container.remove();
                 distortion.remove();
                 document.body.classList.remove('shake');
-            }, cleanupTime);
+            };
+            setTimeout(stop, (endTime - clockNow()) * 1000);
+            return stop;
         }
         
-        function startGlitch() {
+        function startGlitch(endTime) {
             const glitchOverlay = document.getElementById('glitchOverlay');
             glitchOverlay.classList.add('active');
             
-            setTimeout(() => {
-                glitchOverlay.classList.remove('active');
-            }, (eventEndTime - Date.now() / 1000) * 1000);
-        }
-
-        async function updateDisplay() {
-            try {
-                const response = await fetch('/api/state');
-                const data = await response.json();
+            const stop = () => glitchOverlay.classList.remove('active');
+            setTimeout(stop, (endTime - clockNow()) * 1000);
+            return stop;
+        }
+
+        function playEvents(timeline) {
+            const now = clockNow();
+            for (const event of timeline) {
+                if (playedEvents.has(event.id) || now < event.starts_at) continue;
+                playedEvents.add(event.id);
+                const endTime = event.starts_at + event.duration;
+                // An event that ended while this display was not connected is skipped
+                if (now >= endTime) continue;
                 
-                // Update timer
-                const timerElement = document.getElementById('timer');
-                timerElement.style.display = data.timer.visible ? 'block' : 'none';
-                updateTimeDisplay(timerElement, formatTime(data.timer.value));
-                
-                // Update timer progress bar
-                const timerProgressBar = timerElement.querySelector('.progress-bar');
-                timerProgressBar.classList.toggle('active', data.timer.running);
-                timerProgressBar.querySelector('.progress-bar-fill').style.width = '100%';
-
-                // Update countdown
-                const countdownElement = document.getElementById('countdown');
-                countdownElement.style.display = data.countdown.visible ? 'block' : 'none';
-                updateTimeDisplay(countdownElement, formatTime(data.countdown.value));
-
-                // Update countdown progress and ensure progress bar is visible when running
-                const countdownProgressBar = countdownElement.querySelector('.progress-bar');
-                countdownProgressBar.classList.toggle('active', data.countdown.running);
-                if (data.countdown.running && data.countdown.initial > 0) {
-                    const progress = (data.countdown.value / data.countdown.initial) * 100;
-                    countdownProgressBar.querySelector('.progress-bar-fill').style.width = `${progress}%`;
-                } else {
-                    countdownProgressBar.querySelector('.progress-bar-fill').style.width = '0%';
+                let stop = null;
+                if (event.type === 'confetti') {
+                    stop = startConfetti(endTime);
+                } else if (event.type === 'explosion') {
+                    stop = createExplosion(endTime);
+                } else if (event.type === 'glitch') {
+                    stop = startGlitch(endTime);
                 }
-                
-                // Update message
-                const messageElement = document.getElementById('message');
-                if (data.message.text && Date.now() / 1000 < data.message.expires_at) {
-                    if (messageElement.style.display !== 'block') {
-                        messageElement.style.display = 'block';
-                        messageElement.style.setProperty('--msg-color', data.message.color);
-                        messageElement.innerHTML = `
-                            ${data.message.text}
-                            <div class="message-progress">
-                                <div class="message-progress-bar"></div>
-                            </div>
-                        `;
-                        const duration = Math.max(0, data.message.expires_at - Date.now() / 1000);
-                        messageElement.style.setProperty('--duration', `${duration}s`);
-                    }
-                } else {
-                    messageElement.style.display = 'none';
+                if (stop) playingEffects.set(event.id, stop);
+            }
+            // Forget ids the server has dropped from the timeline, cleared effects stop right away
+            const ids = new Set(timeline.map((event) => event.id));
+            playedEvents.forEach((id) => { if (!ids.has(id)) playedEvents.delete(id); });
+            playingEffects.forEach((stop, id) => {
+                if (!ids.has(id)) {
+                    stop();
+                    playingEffects.delete(id);
                 }
+            });
+        }
+
+        // /control/<channel> and /display/<channel> use /api/<channel>, the plain pages the default channel
+        const channel = location.pathname.split('/')[2];
+        const API_BASE = channel ? `/api/${channel}` : '/api';
+
+        // /replay/<channel>/<session>?t=<seconds> plays a recording instead of the live state,
+        // with the clock set back to the time each frame was recorded
+        const replayPath = location.pathname.startsWith('/replay/') ? location.pathname.slice('/replay'.length) : null;
+        let clockOffset = 0;
+
+        function clockNow() {
+            return Date.now() / 1000 + clockOffset;
+        }
+
+        let latestState = null;
+        let stateVersion = -1;
+        let stateEpoch = '';
+        let streamOpen = false;
+        let pollTimer = null;
+
+        // Timers are computed locally from the start anchor the server publishes
+        function currentValue(part) {
+            const value = part.base_value + part.rate * (clockNow() - part.started_at);
+            return Math.max(0, value);
+        }
+
+        // Runs every animation frame, so it only touches the DOM when a value changes
+        function renderTimers() {
+            requestAnimationFrame(renderTimers);
+            if (!latestState) return;
+            const data = latestState;
+            
+            // Update timer
+            const timerElement = document.getElementById('timer');
+            const timerText = formatTime(currentValue(data.timer));
+            if (timerElement.dataset.time !== timerText) {
+                timerElement.dataset.time = timerText;
+                updateTimeDisplay(timerElement, timerText);
+            }
+
+            // Update countdown
+            const countdownElement = document.getElementById('countdown');
+            const countdownValue = currentValue(data.countdown);
+            const countdownText = formatTime(countdownValue);
+            if (countdownElement.dataset.time !== countdownText) {
+                countdownElement.dataset.time = countdownText;
+                updateTimeDisplay(countdownElement, countdownText);
+            }
 
-                // Handle events
-                if (data.event.type && Date.now() / 1000 < data.event.expires_at) {
-                    if (currentEvent !== data.event.type) {
-                        currentEvent = data.event.type;
-                        eventEndTime = data.event.expires_at;
-                        
-                        if (currentEvent === 'confetti') {
-                            startConfetti();
-                        } else if (currentEvent === 'explosion') {
-                            createExplosion();
-                        } else if (currentEvent === 'glitch') {
-                            startGlitch();
-                        }
-                    }
-                } else if (currentEvent && Date.now() / 1000 >= eventEndTime) {
-                    currentEvent = null;
+            // Update countdown progress
+            if (data.countdown.running && data.countdown.initial > 0) {
+                const progress = (countdownValue / data.countdown.initial) * 100;
+                countdownElement.querySelector('.progress-bar-fill').style.width = `${progress}%`;
+            }
+        }
+
+        function updateDisplay() {
+            if (!latestState) return;
+            const data = latestState;
+            
+            // Update timer visibility and progress bar
+            const timerElement = document.getElementById('timer');
+            timerElement.style.display = data.timer.visible ? 'block' : 'none';
+            const timerProgressBar = timerElement.querySelector('.progress-bar');
+            timerProgressBar.classList.toggle('active', data.timer.running);
+            timerProgressBar.querySelector('.progress-bar-fill').style.width = '100%';
+
+            // Update countdown visibility and ensure progress bar is visible when running
+            const countdownElement = document.getElementById('countdown');
+            countdownElement.style.display = data.countdown.visible ? 'block' : 'none';
+            const countdownProgressBar = countdownElement.querySelector('.progress-bar');
+            countdownProgressBar.classList.toggle('active', data.countdown.running);
+            if (!data.countdown.running || data.countdown.initial <= 0) {
+                countdownProgressBar.querySelector('.progress-bar-fill').style.width = '0%';
+            }
+            
+            // Update message
+            const messageElement = document.getElementById('message');
+            if (data.message.text && clockNow() < data.message.expires_at) {
+                // The next queued message can replace the current one without a gap
+                if (messageElement.dataset.expiresAt !== String(data.message.expires_at)) {
+                    messageElement.dataset.expiresAt = data.message.expires_at;
+                    messageElement.style.display = 'block';
+                    messageElement.style.setProperty('--msg-color', data.message.color);
+                    messageElement.innerHTML = `
+                        ${data.message.text}
+                        <div class="message-progress">
+                            <div class="message-progress-bar"></div>
+                        </div>
+                    `;
+                    const duration = Math.max(0, data.message.expires_at - clockNow());
+                    messageElement.style.setProperty('--duration', `${duration}s`);
                 }
+            } else {
+                messageElement.style.display = 'none';
+                delete messageElement.dataset.expiresAt;
+            }
+
+            // Handle events
+            playEvents(data.event.timeline);
+        }
+
+        function applyState(data, version, epoch) {
+            latestState = data;
+            stateVersion = version;
+            stateEpoch = epoch;
+            updateDisplay();
+        }
+
+        // Apply an /api/state?since= answer, which is either a full state or the changed fields
+        function applyDelta(body) {
+            if (body.full) {
+                applyState(body.state, body.version, body.epoch);
+                return;
+            }
+            const merged = Object.assign({}, latestState);
+            for (const [section, fields] of Object.entries(body.changes)) {
+                merged[section] = Object.assign({}, merged[section], fields);
+            }
+            applyState(merged, body.version, body.epoch);
+        }
+
+        // Polling fallback while /api/stream is unavailable
+        async function pollState() {
+            try {
+                const response = await fetch(`${API_BASE}/state?since=${stateVersion}&epoch=${stateEpoch}`);
+                applyDelta(await response.json());
             } catch (err) {
                 console.error('Failed to update display:', err);
             }
-            setTimeout(updateDisplay, 100);
+            pollTimer = streamOpen ? null : setTimeout(pollState, 100);
+        }
+
+        function startPolling() {
+            if (pollTimer === null) {
+                pollTimer = setTimeout(pollState, 0);
+            }
+        }
+
+        function connectStream() {
+            if (!window.EventSource) {
+                startPolling();
+                return;
+            }
+            const source = new EventSource(`${API_BASE}/stream`);
+            source.onopen = () => {
+                streamOpen = true;
+                clearTimeout(pollTimer);
+                pollTimer = null;
+            };
+            source.onmessage = (event) => {
+                // Frame ids are <epoch>-<version>
+                const [epoch, version] = event.lastEventId.split('-');
+                applyState(JSON.parse(event.data), parseInt(version), epoch);
+            };
+            source.onerror = () => {
+                streamOpen = false;
+                source.close();
+                startPolling();
+                setTimeout(connectStream, 5000);
+            };
+        }
+
+        function connectReplay(offset) {
+            const source = new EventSource(`/api/replay${replayPath}/stream?t=${offset}`);
+            let sessionStart = null;
+            source.addEventListener('replay', (event) => {
+                const frame = JSON.parse(event.data);
+                clockOffset = frame.clock - Date.now() / 1000;
+                sessionStart = frame.clock - frame.offset;
+                applyState(frame.state, frame.version);
+            });
+            source.addEventListener('end', () => source.close());
+            source.onerror = () => {
+                source.close();
+                // Pick up where the playback was when the connection dropped
+                const position = sessionStart === null ? offset : clockNow() - sessionStart;
+                setTimeout(() => connectReplay(position), 1000);
+            };
         }
 
         function formatTime(seconds) {
@@ -1647,125 +1990,496 @@ DISPLAY_HTML = """
             return `${h.toString().padStart(2,'0')}:${m.toString().padStart(2,'0')}:${s.toString().padStart(2,'0')}`;
         }
 
-        window.onload = updateDisplay;
+        window.onload = () => {
+            if (replayPath) {
+                connectReplay(parseFloat(new URLSearchParams(location.search).get('t')) || 0);
+            } else {
+                connectStream();
+            }
+            setInterval(updateDisplay, 100);
+            requestAnimationFrame(renderTimers);
+        };
     </script>
 </body>
 </html>
 """
 
+# Media files are fingerprinted by content hash at startup, so pages can link them at
+# immutable URLs such as /media/headerlogo.3f2a9c1b7d4e.png
+MEDIA_DIR = os.path.join(BASE_DIR, 'media')
+FINGERPRINTED_NAME = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[^./]+)$')
+# Browsers reject fonts with a wrong type, and the Windows registry may not know woff2
+mimetypes.add_type('font/woff2', '.woff2')
+
+def fingerprint_media():
+    """Map each file under media/ (relative path with forward slashes) to a short content hash"""
+    fingerprints = {}
+    for root, _, files in os.walk(MEDIA_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:12]
+            fingerprints[os.path.relpath(path, MEDIA_DIR).replace(os.sep, '/')] = digest
+    return fingerprints
+
+media_fingerprints = fingerprint_media()
+
+@app.template_global()
+def media_url(filename):
+    """Immutable URL of a media file, or its plain URL if it was added after startup"""
+    digest = media_fingerprints.get(filename)
+    if not digest:
+        return f'/media/{filename}'
+    stem, ext = os.path.splitext(filename)
+    return f'/media/{stem}.{digest}{ext}'
+
 # Add route to serve media files
 @app.route('/media/<path:filename>')
 def serve_media(filename):
-    media_dir = os.path.join(BASE_DIR, 'media')
-    return send_from_directory(media_dir, filename)
+    match = FINGERPRINTED_NAME.match(filename)
+    if match:
+        original = match['stem'] + match['ext']
+        if media_fingerprints.get(original) == match['hash']:
+            # The URL changes with the content, so browsers never need to ask again
+            response = send_from_directory(MEDIA_DIR, original, etag=match['hash'], max_age=31536000)
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+            return response
+        # Outdated fingerprint from an old page, serve the current file without long caching
+        filename = original
+    digest = media_fingerprints.get(filename, True)
+    response = send_from_directory(MEDIA_DIR, filename, etag=digest)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Pages are rendered and compressed once at startup, each encoding with its own strong ETag
+def build_page(template):
+    """Map each content encoding ('identity', 'gzip', 'br') to the page's (body, etag)"""
+    with app.app_context():
+        html = render_template_string(template).encode('utf-8')
+    digest = hashlib.sha256(html).hexdigest()[:16]
+    variants = {
+        'identity': (html, digest),
+        'gzip': (gzip.compress(html, compresslevel=9, mtime=0), f'{digest}-gz'),
+    }
+    if brotli:
+        variants['br'] = (brotli.compress(html, mode=brotli.MODE_TEXT, quality=11), f'{digest}-br')
+    return variants
+
+def serve_page(page):
+    offered = [encoding for encoding in ('br', 'gzip', 'identity') if encoding in page]
+    encoding = request.accept_encodings.best_match(offered, default='identity')
+    body, etag = page[encoding]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    # OBS reloads browser sources on every scene switch, let it revalidate with a cheap 304
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+CONTROL_PAGE = build_page(CONTROL_HTML)
+DISPLAY_PAGE = build_page(DISPLAY_HTML)
+
+def channel_store(channel):
+    """State store of a channel, 404 for names that cannot be a channel"""
+    store = channels.get(channel)
+    if store is None:
+        abort(404)
+    return store
 
 # Routes
-@app.route('/')
-def control_panel():
-    return render_template_string(CONTROL_HTML)
-
-@app.route('/display')
-def display():
-    return render_template_string(DISPLAY_HTML)
-
-@app.route('/api/state')
-def get_state():
-    with lock:
-        current_time = time.time()
-        
-        # Update timer if running
-        if state['timer']['running']:
-            elapsed = current_time - state['timer']['last_update']
-            state['timer']['value'] += elapsed
-            state['timer']['last_update'] = current_time
-        
-        # Update countdown if running
-        if state['countdown']['running']:
-            elapsed = current_time - state['countdown']['last_update']
-            state['countdown']['value'] = max(0, state['countdown']['value'] - elapsed)
-            state['countdown']['last_update'] = current_time
-            if state['countdown']['value'] <= 0:
-                state['countdown']['running'] = False
-        
-        return jsonify(state)
+# Every page and API route also exists per channel: /control/<channel>, /display/<channel>
+# and /api/<channel>/..., the plain paths use the default channel
+@app.route('/', defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/control/<channel>')
+def control_panel(channel):
+    # The page is the same for every channel, its script picks the API from the URL
+    channel_store(channel)
+    return serve_page(CONTROL_PAGE)
+
+@app.route('/display', defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/display/<channel>')
+def display(channel):
+    channel_store(channel)
+    return serve_page(DISPLAY_PAGE)
+
+@app.route('/api/state', defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/api/<channel>/state')
+def get_state(channel):
+    """Full state, or with ?since=<version>&epoch=<epoch> only the fields changed after that version"""
+    store = channel_store(channel)
+    since = request.args.get('since', type=int)
+    if since is None:
+        current, changes = store.current(), None
+    else:
+        current, changes = store.delta(since, request.args.get('epoch'))
+    etag = state_tag(current)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif since is None:
+        response = Response(current.frame, mimetype='application/json')
+    elif changes is None:
+        response = jsonify({'epoch': current.epoch, 'version': current.version, 'full': True,
+                            'state': current.state})
+    else:
+        response = jsonify({'epoch': current.epoch, 'version': current.version, 'full': False,
+                            'changes': changes})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+class PushLimit:
+    """
+    Open streams and WebSockets of this process, each holds a server thread for as long as it is open
+    Past the limit new ones are refused, so commands and polling pages always find a free thread
+    """
+    def __init__(self):
+        self.limit = None  # No limit where push clients do not hold threads (async and dev servers)
+        self.count = 0
+        self.lock = Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.limit is not None and self.count >= self.limit:
+                return False
+            self.count += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.count -= 1
+
+push_limit = PushLimit()
+
+def push_refused():
+    """503 for a push client past the limit, the pages fall back to polling /api/state"""
+    response = jsonify({'success': False, 'error': 'Too many open streams, poll /api/state instead'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(STREAM_KEEPALIVE)
+    return response
+
+def limited_stream(generate):
+    """Streaming response that gives its push client slot back when the server closes it"""
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(push_limit.release)
+    return response
+
+@app.route('/api/stream', defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/api/<channel>/stream')
+def stream_state(channel):
+    """Server-Sent Events stream that sends the state on connect and again after every change"""
+    store = channel_store(channel)
+    if not push_limit.acquire():
+        return push_refused()
+
+    def generate():
+        client = store.subscribe()
+        try:
+            with store.connection('stream'):
+                current = store.current()
+                yield f"retry: 1000\nid: {state_tag(current)}\ndata: {current.frame}\n\n"
+                while True:
+                    try:
+                        snapshot = client.get(timeout=STREAM_KEEPALIVE)
+                        yield f"id: {state_tag(snapshot)}\ndata: {snapshot.frame}\n\n"
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+        finally:
+            store.unsubscribe(client)
+    
+    return limited_stream(generate)
 
 # Timer endpoints
-@app.route('/api/timer/<action>', methods=['POST'])
-def timer_control(action):
-    with lock:
-        if action == 'start':
-            state['timer']['running'] = True
-            state['timer']['last_update'] = time.time()
-        elif action == 'stop':
-            state['timer']['running'] = False
-        elif action == 'reset':
-            state['timer']['value'] = 0
-            state['timer']['running'] = False
+@app.route('/api/timer/<action>', methods=['POST'], defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/api/<channel>/timer/<action>', methods=['POST'])
+def timer_control(channel, action):
+    with channel_store(channel).update() as state:
+        apply_timer(state, action)
     return jsonify({'success': True})
 
 # Countdown endpoints
-@app.route('/api/countdown/<action>', methods=['POST'])
-def countdown_control(action):
-    with lock:
-        if action == 'start':
-            data = request.get_json()
-            minutes = float(data.get('minutes', 0))
-            total_seconds = minutes * 60
-            state['countdown']['value'] = total_seconds
-            state['countdown']['initial'] = total_seconds  # Store initial value
-            state['countdown']['running'] = True
-            state['countdown']['last_update'] = time.time()
-        elif action == 'stop':
-            state['countdown']['running'] = False
-        elif action == 'reset':
-            state['countdown']['value'] = 0
-            state['countdown']['initial'] = 0
-            state['countdown']['running'] = False
+@app.route('/api/countdown/<action>', methods=['POST'], defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/api/<channel>/countdown/<action>', methods=['POST'])
+def countdown_control(channel, action):
+    data = request.get_json() if action == 'start' else {}
+    try:
+        with channel_store(channel).update() as state:
+            apply_countdown(state, action, data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     return jsonify({'success': True})
 
 # Visibility toggle endpoints
-@app.route('/api/visibility/<element>', methods=['POST'])
-def toggle_visibility(element):
-    with lock:
-        if element in ['timer', 'countdown']:
-            state[element]['visible'] = not state[element]['visible']
+@app.route('/api/visibility/<element>', methods=['POST'], defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/api/<channel>/visibility/<element>', methods=['POST'])
+def toggle_visibility(channel, element):
+    with channel_store(channel).update() as state:
+        apply_visibility(state, element)
     return jsonify({'success': True})
 
 # Message endpoints
-@app.route('/api/message', methods=['POST'])
-def set_message():
-    with lock:
-        data = request.get_json()
-        message_text = data.get('text', '')
-        state['message']['text'] = message_text
-        state['message']['color'] = data.get('color', '#b71c1c')
-        duration = float(data.get('duration', 5))
-        state['message']['expires_at'] = time.time() + duration
-        
-        # Trigger TTS for the message
-        if message_text:
-            speak(message_text)
-    
+@app.route('/api/message', methods=['POST'], defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/api/<channel>/message', methods=['POST'])
+def set_message(channel):
+    data = request.get_json()
+    try:
+        with channel_store(channel).update() as state:
+            apply_message(state, data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True})
+
+@app.route('/api/message/skip', methods=['POST'], defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/api/<channel>/message/skip', methods=['POST'])
+def skip_message(channel):
+    with channel_store(channel).update() as state:
+        apply_skip_message(state)
     return jsonify({'success': True})
 
-@app.route('/api/message/clear', methods=['POST'])
-def clear_message():
-    with lock:
-        state['message']['text'] = ''
-        state['message']['expires_at'] = 0
+@app.route('/api/message/clear', methods=['POST'], defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/api/<channel>/message/clear', methods=['POST'])
+def clear_message(channel):
+    with channel_store(channel).update() as state:
+        apply_clear_message(state)
     return jsonify({'success': True})
 
 # Event endpoint
-@app.route('/api/event', methods=['POST'])
-def trigger_event():
-    with lock:
-        data = request.get_json()
-        event_type = data.get('type', '')
-        duration = float(data.get('duration', 5))
-        state['event']['type'] = event_type
-        state['event']['expires_at'] = time.time() + duration
-    
+@app.route('/api/event', methods=['POST'], defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/api/<channel>/event', methods=['POST'])
+def trigger_event(channel):
+    data = request.get_json()
+    try:
+        with channel_store(channel).update() as state:
+            event_id = apply_event(state, data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'id': event_id})
+
+@app.route('/api/event/clear', methods=['POST'], defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/api/<channel>/event/clear', methods=['POST'])
+def clear_events(channel):
+    with channel_store(channel).update() as state:
+        apply_clear_events(state)
+    return jsonify({'success': True})
+
+# Replay of recorded sessions, for rendering the overlay onto a VOD
+def replay_timeline(channel, session):
+    timeline = None
+    if CHANNEL_NAME.fullmatch(channel):
+        timeline = open_timeline(app.config['RECORDINGS_DIR'], channel, session)
+    if timeline is None:
+        abort(404)
+    return timeline
+
+@app.route('/replay/<channel>/<session>')
+def replay_display(channel, session):
+    replay_timeline(channel, session)
+    return serve_page(DISPLAY_PAGE)
+
+@app.route('/api/replay')
+def list_replays():
+    """Recorded sessions of every channel"""
+    return jsonify(list_sessions(app.config['RECORDINGS_DIR']))
+
+@app.route('/api/replay/<channel>/<session>')
+def replay_info(channel, session):
+    timeline = replay_timeline(channel, session)
+    return jsonify({'start': timeline.start, 'end': timeline.end(), 'keyframes': timeline.keyframes})
+
+@app.route('/api/replay/<channel>/<session>/state')
+def replay_state(channel, session):
+    """The recorded state ?t=<seconds> into the session"""
+    timeline = replay_timeline(channel, session)
+    at = timeline.start + request.args.get('t', 0.0, type=float)
+    _, _, frame = next(timeline.frames(at))
+    return Response(frame, mimetype='application/json')
+
+@app.route('/api/replay/<channel>/<session>/stream')
+def replay_stream(channel, session):
+    """Server-Sent Events playback from ?t=<seconds> into the session, in real time"""
+    timeline = replay_timeline(channel, session)
+    at = timeline.start + request.args.get('t', 0.0, type=float)
+    if not push_limit.acquire():
+        return push_refused()
+
+    def generate():
+        started = time.monotonic()
+        for recorded_at, version, frame in timeline.frames(at):
+            # Wait until the frame is due, keeping the connection alive through quiet stretches
+            while True:
+                wait = (recorded_at - at) - (time.monotonic() - started)
+                if wait <= 0:
+                    break
+                if wait > STREAM_KEEPALIVE:
+                    time.sleep(STREAM_KEEPALIVE)
+                    yield ": keep-alive\n\n"
+                else:
+                    time.sleep(wait)
+            yield f"event: replay\nid: {version}\ndata: {frame}\n\n"
+        yield "event: end\ndata: \n\n"
+
+    return limited_stream(generate)
+
+# Batch endpoint: several commands applied as one state change
+@app.route('/api/batch', methods=['POST'], defaults={'channel': DEFAULT_CHANNEL})
+@app.route('/api/<channel>/batch', methods=['POST'])
+def batch(channel):
+    """Apply {"commands": [{"command", "data"}, ...]} (or just the list) all together or not at all"""
+    data = request.get_json(silent=True)
+    commands = data.get('commands') if isinstance(data, dict) else data
+    try:
+        with channel_store(channel).update() as state:
+            apply_batch(state, commands)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     return jsonify({'success': True})
 
+# WebSocket channel: commands in, acks and state frames out on one connection
+if sock:
+    def command_socket(ws, channel):
+        """Accept {"id", "command", "data"} messages and answer with acks and state frames"""
+        store = channel_store(channel)
+        # Acks and state frames are tiny, send them without Nagle delay
+        ws.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = store.subscribe()
+        send_lock = Lock()
+        
+        def send(message):
+            with send_lock:
+                ws.send(message)
+        
+        def forward_state():
+            while True:
+                item = client.get()
+                if item is None:
+                    break
+                try:
+                    send(state_message(item))
+                except Exception:
+                    break
+        
+        try:
+            with store.connection('websocket'):
+                send(state_message(store.current()))
+                Thread(target=forward_state, daemon=True).start()
+                
+                while True:
+                    ack = handle_socket_message(store, ws.receive())
+                    send(json.dumps(ack))
+        finally:
+            store.unsubscribe(client)
+            offer(client, None)
+
+    # flask-sock wraps the view, so each path gets its own wrapper and endpoint
+    sock.route('/api/ws', defaults={'channel': DEFAULT_CHANNEL})(command_socket)
+    sock.route('/api/<channel>/ws', endpoint='channel_command_socket')(command_socket)
+
+    def limit_push_clients(view):
+        """Refuse a WebSocket past the push client limit before flask-sock answers its handshake"""
+        @wraps(view)
+        def limited(*args, **kwargs):
+            if not push_limit.acquire():
+                return push_refused()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                push_limit.release()
+        return limited
+
+    for endpoint in ('command_socket', 'channel_command_socket'):
+        app.view_functions[endpoint] = limit_push_clients(app.view_functions[endpoint])
+
+# Prometheus metrics: request latency per route, channels and TTS
+metrics.instrument(app, channels, tts_manager)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metrics of this process in the Prometheus text format, labelled with its pid as worker"""
+    response = Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def main():
+    parser = argparse.ArgumentParser(description='REDLIX Streaming Tools server')
+    parser.add_argument('--server', choices=['wsgi', 'async', 'dev'], default='wsgi',
+                        help="'wsgi' runs a production server (gunicorn or waitress), "
+                             "'async' an asyncio server for many push clients, "
+                             "'dev' the Flask debug server with reloader")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--threads', type=int, default=32,
+                        help='Threads per worker (wsgi), or for the Flask routes (async)')
+    parser.add_argument('--push-clients', type=int,
+                        help='Streams and WebSockets per worker before pages fall back to polling '
+                             '(wsgi, default: the threads left after keeping a quarter, at least 2, free)')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes (wsgi, gunicorn only)')
+    parser.add_argument('--keep-alive', type=int, default=5, help='Seconds to keep idle connections open')
+    parser.add_argument('--backlog', type=int, default=2048, help='Maximum number of pending connections')
+    parser.add_argument('--data-dir', default=os.path.join(BASE_DIR, 'data'),
+                        help='Directory where timers, messages and events are saved across restarts')
+    parser.add_argument('--no-persistence', action='store_true', help='Start from a blank state every time')
+    parser.add_argument('--backend', choices=['memory', 'shm', 'redis'], default='memory',
+                        help="'memory' keeps state in this process, 'shm' shares it between the workers "
+                             "on this machine, 'redis' between workers and hosts")
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0', help='Redis server (redis backend)')
+    parser.add_argument('--record', action='store_true', help='Record every state change for replay')
+    parser.add_argument('--tts-cache-mb', type=float, default=32,
+                        help='Memory for synthesized speech, repeated texts skip Google TTS')
+    parser.add_argument('--tts-disk-cache-mb', type=float, default=256,
+                        help='Disk space for synthesized speech, kept across restarts (0 turns it off)')
+    parser.add_argument('--tts-cache-dir', default=os.path.join(BASE_DIR, 'cache', 'tts'),
+                        help='Directory of the disk cache for synthesized speech')
+    parser.add_argument('--tts-decoded-cache-mb', type=float, default=16,
+                        help='Memory for decoded speech, so repeated texts also skip language detection and '
+                             'the MP3 decode (0 turns it off)')
+    parser.add_argument('--no-tts-cache', action='store_true', help='Synthesize every text again')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time routes and state locks, and serve /admin/profile and /admin/profile/flamegraph')
+    parser.add_argument('--recordings-dir', default=app.config['RECORDINGS_DIR'],
+                        help='Directory for recorded sessions')
+    args = parser.parse_args()
+    
+    if args.server == 'wsgi' and args.workers > 1 and args.backend == 'memory' and not args.no_persistence:
+        # Every worker would append its own versions to the same files
+        parser.error("several --workers cannot share the saved state, "
+                     "add --backend shm or redis to share it, or --no-persistence")
+    if args.backend == 'redis':
+        from backends import RedisBackend
+        # Redis keeps the state, so the local log is not needed
+        channels.use_backend(RedisBackend(args.redis_url))
+    elif args.backend == 'shm':
+        from backends import SharedMemoryBackend
+        # Created before the workers are forked, so they all map the same block
+        channels.use_backend(SharedMemoryBackend(reserved=[DEFAULT_CHANNEL]))
+    elif not args.no_persistence:
+        channels.enable_persistence(args.data_dir)
+    app.config['RECORDINGS_DIR'] = args.recordings_dir
+    if not args.no_tts_cache:
+        tts_manager.enable_cache(int(args.tts_cache_mb * 2**20),
+                                 args.tts_cache_dir if args.tts_disk_cache_mb > 0 else None,
+                                 int(args.tts_disk_cache_mb * 2**20), int(args.tts_decoded_cache_mb * 2**20))
+    if args.profile:
+        import profiling
+        profiling.enable(app, channels)
+    if args.record:
+        channels.enable_recording(args.recordings_dir)
+    
+    if args.server == 'wsgi':
+        import wsgi_server
+        push_limit.limit = wsgi_server.push_client_limit(args.threads, args.push_clients)
+        wsgi_server.run(app, args.host, args.port, threads=args.threads, workers=args.workers,
+                        keep_alive=args.keep_alive, backlog=args.backlog, shared_state=args.backend != 'memory')
+    elif args.server == 'async':
+        import async_server
+        async_server.run(app, args.host, args.port, threads=args.threads, keep_alive=args.keep_alive,
+                         backlog=args.backlog)
+    else:
+        app.run(host=args.host, port=args.port, debug=True)
+
 if __name__ == '__main__':
-    app.run(host='127.0.0.1', port=8765, debug=True)
\ No newline at end of file
+    main()
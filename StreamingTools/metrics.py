@@ -0,0 +1,183 @@
+from bisect import bisect_left
+from threading import Lock
+import os
+import time
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# Prometheus metrics for the HTTP routes, the channels and TTS, served as text on /metrics
+# Every server process (each gunicorn worker) counts on its own, its samples carry its pid as the worker label
+
+# Upper bounds of the latency buckets in seconds, +Inf is added on output
+HTTP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+TTS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+def add_worker(labels, worker):
+    """Put the worker label in front of a sample's labels, so the series of different workers never mix"""
+    return '{' + worker + (',' + labels[1:] if labels else '}')
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """A count per label combination that only goes up"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        for label_values, value in values:
+            yield self.name, format_labels(self.labels, label_values), value
+
+class Histogram:
+    """Observations per label combination, counted into fixed buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=HTTP_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # Label values -> [count per bucket (not cumulative, the last one is +Inf), sum]
+        self.values = {}
+        self.lock = Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            values = [(label_values, list(counts), total) for label_values, (counts, total) in self.values.items()]
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else format_value(bound)
+                yield (f'{self.name}_bucket', format_labels(self.labels + ('le',), label_values + (le,)),
+                       cumulative)
+            labels = format_labels(self.labels, label_values)
+            yield f'{self.name}_count', labels, cumulative
+            yield f'{self.name}_sum', labels, total
+
+class Gauge:
+    """Values read when /metrics is scraped, collect() returns (label values, value) pairs"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, collect, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.collect = collect
+
+    def samples(self):
+        for label_values, value in self.collect():
+            yield self.name, format_labels(self.labels, label_values), value
+
+class CollectedCounter(Gauge):
+    """A count kept elsewhere that only goes up, read when /metrics is scraped"""
+    kind = 'counter'
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+        lines = []
+        # Read on every render, a forked worker has a pid of its own
+        worker = format_labels(('worker',), (os.getpid(),))[1:-1]
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{add_worker(labels, worker)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+http_requests = registry.add(Counter(
+    'redlix_http_requests_total', 'HTTP requests by route and status code', ('endpoint', 'status')))
+http_latency = registry.add(Histogram(
+    'redlix_http_request_duration_seconds', 'Time to produce the response (streams: until they start)',
+    ('endpoint',)))
+tts_stages = registry.add(Histogram(
+    'redlix_tts_stage_duration_seconds',
+    'Time spent in each TTS stage: clean, detect, cache, synthesize, decode, play', ('stage',),
+    buckets=TTS_BUCKETS))
+tts_failures = registry.add(Counter('redlix_tts_failures_total', 'Texts that could not be spoken'))
+
+def instrument(app, channels, tts_manager):
+    """Time every request of the Flask app and collect channel and TTS values on each scrape"""
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('metrics_started')
+        if started is not None:
+            # The route name keeps the label count bounded, /api/state and /api/<channel>/state share one
+            endpoint = request.endpoint or 'unmatched'
+            http_latency.observe(time.perf_counter() - started, endpoint)
+            http_requests.inc(endpoint, str(response.status_code))
+        return response
+
+    def push_clients():
+        return [((name, transport), count) for name, store in list(channels.channels.items())
+                for transport, count in list(store.connections.items())]
+
+    def state_versions():
+        return [((name,), store.snapshot.version) for name, store in list(channels.channels.items())]
+
+    registry.add(Gauge('redlix_push_clients',
+                       'Open push connections: stream (/api/stream, displays) and websocket (/api/ws, control panels)',
+                       push_clients, ('channel', 'transport')))
+    registry.add(Gauge('redlix_state_version', 'Current state version of each channel',
+                       state_versions, ('channel',)))
+    registry.add(Gauge('redlix_tts_queue_depth', 'Texts waiting to be spoken',
+                       lambda: [((), tts_manager.tts_queue.qsize())]))
+
+    def cache_lookups():
+        cache = tts_manager.cache
+        if not cache:
+            return []
+        return [(('decoded',), cache.decoded_hits), (('hit',), cache.hits), (('miss',), cache.misses)]
+
+    registry.add(CollectedCounter('redlix_tts_cache_lookups_total',
+                                  'TTS audio cache lookups by result: decoded audio, MP3 or neither',
+                                  cache_lookups, ('result',)))
+
+    tts_manager.stage_hooks.append(lambda stage, seconds: tts_stages.observe(seconds, stage))
+    tts_manager.failure_hooks.append(lambda text, error: tts_failures.inc())
@@ -0,0 +1,154 @@
+from threading import Lock, Thread
+import json
+import os
+import queue
+import time
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# Durable channel state: an append-only log of state changes with periodic snapshots
+
+SNAPSHOT_INTERVAL = 1000  # Log entries per channel before a snapshot replaces the log
+GROUP_COMMIT_DELAY = 0.01  # Seconds the writer waits to gather more entries into one fsync
+
+class BackgroundWriter:
+    """Hands entries to one thread that writes them in groups, so requests never wait on the disk"""
+    def __init__(self):
+        self.entries = queue.Queue()
+        self.worker_thread = None
+        self.worker_lock = Lock()
+
+    def put(self, entry):
+        with self.worker_lock:
+            # Started on the first entry rather than on import, so it runs in the serving process
+            if not (self.worker_thread and self.worker_thread.is_alive()):
+                self.worker_thread = Thread(target=self._process_queue, daemon=True)
+                self.worker_thread.start()
+        self.entries.put(entry)
+
+    def _process_queue(self):
+        while True:
+            batch = [self.entries.get()]
+            time.sleep(GROUP_COMMIT_DELAY)
+            while True:
+                try:
+                    batch.append(self.entries.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"Error writing {type(self).__name__}: {e}")
+
+    def _write(self, batch):
+        raise NotImplementedError
+
+class StateJournal(BackgroundWriter):
+    """
+    Writes every published change of every channel to <directory>/<channel>.log
+    Entries are fsynced in groups, one fsync per file for everything that arrived together
+    """
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.files = {}
+        self.logged = {}  # Entries in each channel's log since its last snapshot
+        self.written = {}  # Last version of each channel that is on disk
+
+    def _paths(self, name):
+        base = os.path.join(self.directory, name)
+        return f'{base}.log', f'{base}.snapshot.json'
+
+    def load(self, name):
+        """Return (version, state) from the channel's snapshot and log, or None if nothing was saved"""
+        log_path, snapshot_path = self._paths(name)
+        version, state = 0, None
+        try:
+            with open(snapshot_path, encoding='utf-8') as f:
+                saved = json.load(f)
+            version, state = saved['version'], saved['state']
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            print(f"Error loading snapshot of channel {name}: {e}")
+
+        replayed = 0
+        try:
+            with open(log_path, 'r+b') as f:
+                intact = 0
+                for line in f:
+                    try:
+                        # Every complete entry ends with a newline
+                        entry = json.loads(line) if line.endswith(b'\n') else None
+                    except ValueError:
+                        entry = None
+                    if entry is None:
+                        # A torn last line from a crash, cut it off so new entries start on a clean line
+                        f.truncate(intact)
+                        break
+                    intact += len(line)
+                    # Entries up to the snapshot's version are already part of it
+                    if entry['version'] <= version:
+                        continue
+                    state = state or {}
+                    for section, fields in entry['changes'].items():
+                        state.setdefault(section, {}).update(fields)
+                    version = entry['version']
+                    replayed += 1
+        except FileNotFoundError:
+            pass
+
+        self.written[name] = version
+        self.logged[name] = replayed
+        return (version, state) if state is not None else None
+
+    def append(self, store, version, changes):
+        """Queue a published change for writing (called with the store's lock held, keeping the order)"""
+        self.put((store, version, changes))
+
+    def _write(self, batch):
+        touched = {}
+        for store, version, changes in batch:
+            name = store.name
+            # Changes taken into a snapshot while they were queued are not logged again
+            if version <= self.written.get(name, 0):
+                continue
+            log = self._log_file(name)
+            log.write(json.dumps({'version': version, 'changes': changes}) + '\n')
+            self.written[name] = version
+            self.logged[name] = self.logged.get(name, 0) + 1
+            touched[name] = store
+
+        # One fsync per file for the whole group
+        for name in touched:
+            log = self.files[name]
+            log.flush()
+            os.fsync(log.fileno())
+
+        for name, store in touched.items():
+            if self.logged[name] >= SNAPSHOT_INTERVAL:
+                self._write_snapshot(store)
+
+    def _log_file(self, name):
+        log = self.files.get(name)
+        if log is None:
+            log = self.files[name] = open(self._paths(name)[0], 'a', encoding='utf-8')
+        return log
+
+    def _write_snapshot(self, store):
+        """Save the store's current snapshot and start an empty log after it"""
+        log_path, snapshot_path = self._paths(store.name)
+        current = store.snapshot
+        temp_path = snapshot_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': current.version, 'state': current.state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, snapshot_path)
+
+        # The snapshot may be ahead of the log, queued changes it covers are skipped in _write
+        self.files.pop(store.name).close()
+        self.files[store.name] = open(log_path, 'w', encoding='utf-8')
+        self.written[store.name] = current.version
+        self.logged[store.name] = 0
@@ -0,0 +1,199 @@
+from collections import Counter
+from threading import Lock, get_ident, local
+import os
+import sys
+import threading
+import time
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# Opt-in profiling (--profile): time spent per route and on the channel state locks,
+# and sampled stack profiles of every thread in the flamegraph folded format
+
+MAX_CAPTURE_SECONDS = 60
+DEFAULT_SAMPLE_INTERVAL = 0.005  # Seconds between two stack samples
+BACKGROUND = '(background)'  # Lock time of threads outside a request, e.g. the countdown timers
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock_wait = 0.0
+        self.lock_hold = 0.0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'mean_seconds': self.total / self.count if self.count else 0.0,
+            'max_seconds': self.max,
+            'lock_wait_seconds': self.lock_wait,
+            'lock_hold_seconds': self.lock_hold,
+        }
+
+class Profiler:
+    """Per-route timings, with the state lock time of each request added to its route"""
+    def __init__(self):
+        self.routes = {}
+        self.stats_lock = Lock()
+        self.current = local()  # The request a thread is handling: route, started, lock wait and hold
+        self.capture_lock = Lock()
+
+    def _stats(self, route):
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = RouteStats()
+        return stats
+
+    def start_request(self, route):
+        self.current.route = route
+        self.current.started = time.perf_counter()
+        self.current.lock_wait = self.current.lock_hold = 0.0
+
+    def finish_request(self):
+        route = getattr(self.current, 'route', None)
+        if route is None:
+            return
+        elapsed = time.perf_counter() - self.current.started
+        self.current.route = None
+        with self.stats_lock:
+            stats = self._stats(route)
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.lock_wait += self.current.lock_wait
+            stats.lock_hold += self.current.lock_hold
+
+    def lock_timed(self, waited, held):
+        """Add the time one acquisition of a state lock waited and was held"""
+        if getattr(self.current, 'route', None) is not None:
+            self.current.lock_wait += waited
+            self.current.lock_hold += held
+        else:
+            with self.stats_lock:
+                stats = self._stats(BACKGROUND)
+                stats.lock_wait += waited
+                stats.lock_hold += held
+
+    def timed_lock(self):
+        """A new state lock reporting to this profiler, see ChannelRegistry.use_lock_factory"""
+        return TimedLock(self)
+
+    def report(self):
+        """Stats of every route, the one with the most total time first"""
+        with self.stats_lock:
+            routes = [{'route': route, **stats.as_dict()} for route, stats in self.routes.items()]
+        # Background threads have no request time, only lock time
+        return sorted(routes, key=lambda stats: max(stats['total_seconds'], stats['lock_hold_seconds']), reverse=True)
+
+    def reset(self):
+        with self.stats_lock:
+            self.routes = {}
+
+    def capture(self, seconds, interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        Sample the stacks of every other thread for the given time and return them folded,
+        one "thread;outer frame;...;inner frame count" line per distinct stack
+        Returns None while another capture is running
+        """
+        if not self.capture_lock.acquire(blocking=False):
+            return None
+        try:
+            own = get_ident()
+            stacks = Counter()
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident != own:
+                        stacks[fold_stack(names.get(ident, f'thread-{ident}'), frame)] += 1
+                time.sleep(interval)
+        finally:
+            self.capture_lock.release()
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+class TimedLock:
+    """threading.Lock that reports how long each acquisition waited and held it"""
+    def __init__(self, profiler):
+        self.lock = Lock()
+        self.profiler = profiler
+        self.acquired_at = 0.0
+        self.waited = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        if acquired:
+            # Only the holder writes these
+            self.acquired_at = time.perf_counter()
+            self.waited = self.acquired_at - started
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self.acquired_at
+        waited = self.waited
+        self.lock.release()
+        self.profiler.lock_timed(waited, held)
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+def fold_stack(thread_name, frame):
+    """One folded stack line, the thread's name first and the innermost frame last"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    frames.append(thread_name)
+    # Semicolons separate the frames, the count follows the last space
+    return ';'.join(name.replace(';', ':') for name in reversed(frames))
+
+profiler = Profiler()
+
+def enable(app, channels):
+    """Profile every request of the Flask app and the state locks of channels, and add the /admin/profile routes"""
+    from flask import Response, abort, jsonify, request
+
+    channels.use_lock_factory(profiler.timed_lock)
+
+    @app.before_request
+    def start_profiling():
+        profiler.start_request(request.endpoint or 'unmatched')
+
+    @app.teardown_request
+    def finish_profiling(error=None):
+        profiler.finish_request()
+
+    def profile_report():
+        """Time per route and the state lock time of its requests, DELETE starts over"""
+        if request.method == 'DELETE':
+            profiler.reset()
+            return jsonify({'success': True})
+        return jsonify(profiler.report())
+
+    def profile_flamegraph():
+        """Sample every thread for ?seconds= (default 10) and download the folded stacks"""
+        seconds = request.args.get('seconds', 10, type=float)
+        interval = request.args.get('interval', DEFAULT_SAMPLE_INTERVAL, type=float)
+        if not 0 < seconds <= MAX_CAPTURE_SECONDS or not 0.001 <= interval <= 1:
+            abort(400)
+        folded = profiler.capture(seconds, interval)
+        if folded is None:
+            return jsonify({'success': False, 'error': 'A capture is already running'}), 409
+        response = Response(folded, mimetype='text/plain')
+        response.headers['Content-Disposition'] = \
+            f'attachment; filename="redlix-{time.strftime("%Y%m%d-%H%M%S")}.folded"'
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    app.add_url_rule('/admin/profile', view_func=profile_report, methods=['GET', 'DELETE'])
+    app.add_url_rule('/admin/profile/flamegraph', view_func=profile_flamegraph)
@@ -0,0 +1,186 @@
+from persistence import BackgroundWriter
+import json
+import os
+import re
+import struct
+import time
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# Timeline recording of every state change, and seekable playback of recorded sessions
+
+KEYFRAME_INTERVAL = 100  # Changes between two full states in a recording
+INDEX_ENTRY = struct.Struct('<dQ')  # Keyframe time and its byte offset in the .timeline file
+SESSION_NAME = re.compile(r'\d{8}-\d{6}(-\d+)?')
+
+# A session is <directory>/<channel>/<session>.timeline, one JSON record per line:
+#   {"t": 1760799312.25, "v": 7, "state": {...}}    keyframe, the full state
+#   {"t": 1760799314.5, "v": 8, "changes": {...}}   the fields changed by one update
+# and <session>.index, a packed INDEX_ENTRY for every keyframe
+
+class TimelineRecorder(BackgroundWriter):
+    """
+    Records every published change of every channel with its time, one session per channel and server run
+    Worker processes forked from the one that created the recorder each write their own session,
+    named <start time>-<process id>, since appending to the same files would mix up their offsets
+    """
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self.started = time.strftime('%Y%m%d-%H%M%S')
+        self.owner = self.pid = os.getpid()
+        self.since_keyframe = {}
+        self.files = {}
+
+    @property
+    def session(self):
+        pid = os.getpid()
+        return self.started if pid == self.owner else f'{self.started}-{pid}'
+
+    def start(self, store):
+        """Begin or continue a channel's recording with a keyframe of its current state"""
+        current = store.snapshot
+        self.since_keyframe[store.name] = 0
+        self.put((store.name, time.time(), current.version, None, current.state))
+
+    def append(self, store, version, changes):
+        """
+        Record a published change (called with the store's lock held, so records stay in order)
+        Without changes, e.g. for a version taken over from another process across a gap, a keyframe is recorded
+        """
+        count = self.since_keyframe.get(store.name, 0) + 1
+        keyframe = changes is None or count >= KEYFRAME_INTERVAL
+        self.since_keyframe[store.name] = 0 if keyframe else count
+        # Published states are never changed, so the writer thread can serialize this one later
+        self.put((store.name, time.time(), version, changes, store.snapshot.state if keyframe else None))
+
+    def _write(self, batch):
+        touched = set()
+        for name, recorded_at, version, changes, state in batch:
+            timeline, index = self._files(name)
+            if state is not None:
+                index.write(INDEX_ENTRY.pack(recorded_at, timeline.tell()))
+                record = {'t': recorded_at, 'v': version, 'state': state}
+            else:
+                record = {'t': recorded_at, 'v': version, 'changes': changes}
+            timeline.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+            touched.add(name)
+        for name in touched:
+            for f in self.files[name]:
+                f.flush()
+
+    def _files(self, name):
+        if self.pid != os.getpid():
+            # Forked after the parent opened its files, this process starts its own session
+            self.pid = os.getpid()
+            self.files = {}
+        files = self.files.get(name)
+        if files is None:
+            base = os.path.join(self.directory, name)
+            os.makedirs(base, exist_ok=True)
+            path = os.path.join(base, self.session)
+            files = self.files[name] = (open(path + '.timeline', 'ab'), open(path + '.index', 'ab'))
+        return files
+
+class Timeline:
+    """
+    A recorded session, seekable through its keyframe index
+    The index is searched in place, so opening a long recording reads a few entries instead of all of them
+    """
+    def __init__(self, path):
+        self.path = path
+        self.keyframes = os.path.getsize(path + '.index') // INDEX_ENTRY.size
+        size = os.path.getsize(path + '.timeline')
+        with open(path + '.index', 'rb') as f:
+            # Keyframes the recorder indexed but did not get to write before a crash are left out
+            while self.keyframes and self._entry(f, self.keyframes - 1)[1] >= size:
+                self.keyframes -= 1
+            if not self.keyframes:
+                raise ValueError(f"Empty recording: {path}")
+            self.start = self._entry(f, 0)[0]
+            self.last_keyframe = self._entry(f, self.keyframes - 1)
+
+    @staticmethod
+    def _entry(f, position):
+        """(time, offset) of the keyframe at position in the index file"""
+        f.seek(position * INDEX_ENTRY.size)
+        return INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+
+    def seek(self, at):
+        """Offset of the last keyframe recorded at or before at (the first one if there is none)"""
+        with open(self.path + '.index', 'rb') as f:
+            # bisect_right over the keyframe times, reading one entry per step
+            low, high = 0, self.keyframes
+            while low < high:
+                middle = (low + high) // 2
+                if at < self._entry(f, middle)[0]:
+                    high = middle
+                else:
+                    low = middle + 1
+            return self._entry(f, max(0, low - 1))[1]
+
+    def end(self):
+        """Time of the last record"""
+        end, offset = self.last_keyframe
+        with open(self.path + '.timeline', 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if line.endswith(b'\n'):
+                    end = json.loads(line)['t']
+        return end
+
+    def play(self, at):
+        """
+        Yield (time, version, state), first the state at time at, then the state after every later change
+        The binary search over the keyframes means a seek reads at most KEYFRAME_INTERVAL records
+        """
+        at = max(at, self.start)
+        position = self.seek(at)
+        state, version, seeking = None, 0, True
+        with open(self.path + '.timeline', 'rb') as f:
+            f.seek(position)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # The recorder is still writing this record
+                record = json.loads(line)
+                if seeking and record['t'] > at:
+                    seeking = False
+                    yield at, version, state
+                if 'state' in record:
+                    state = record['state']
+                else:
+                    # New section dicts, so states already handed out never change
+                    state = dict(state)
+                    for section, fields in record['changes'].items():
+                        state[section] = {**state.get(section, {}), **fields}
+                version = record['v']
+                if not seeking:
+                    yield record['t'], version, state
+        if seeking:
+            yield at, version, state
+
+    def frames(self, at):
+        """play(at) with each state as the JSON frame the replay routes send"""
+        for recorded_at, version, state in self.play(at):
+            yield recorded_at, version, json.dumps({'clock': recorded_at, 'offset': recorded_at - self.start,
+                                                    'version': version, 'state': state})
+
+def list_sessions(directory):
+    """Map each recorded channel to its session names, oldest first"""
+    sessions = {}
+    if os.path.isdir(directory):
+        for channel in sorted(os.listdir(directory)):
+            names = sorted(name[:-len('.timeline')] for name in os.listdir(os.path.join(directory, channel))
+                           if name.endswith('.timeline'))
+            if names:
+                sessions[channel] = names
+    return sessions
+
+def open_timeline(directory, channel, session):
+    """The recorded session of a valid channel name, or None if there is no such recording"""
+    if not SESSION_NAME.fullmatch(session):
+        return None
+    try:
+        return Timeline(os.path.join(directory, channel, session))
+    except (OSError, ValueError):
+        return None
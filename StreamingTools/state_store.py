@@ -0,0 +1,619 @@
+from backends import ChannelLimitError, MemoryBackend
+from collections import namedtuple
+from contextlib import contextmanager
+from persistence import StateJournal
+from recording import TimelineRecorder
+from threading import Lock, Timer
+from tts import speak
+import copy
+import json
+import math
+import queue
+import re
+import secrets
+import time
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# Overlay state, change log and push fan-out shared by every server mode
+
+# Number of recent (version, changes) pairs kept for /api/state?since=<version>
+CHANGE_LOG_SIZE = 256
+STREAM_QUEUE_SIZE = 8
+STREAM_KEEPALIVE = 15  # Seconds between keep-alive comments on an idle stream
+
+# Channels are independent overlays served by one process, e.g. /display/<channel>
+DEFAULT_CHANNEL = 'default'
+CHANNEL_NAME = re.compile(r'[A-Za-z0-9_-]{1,32}')
+# First path segments of the default channel's API, a channel cannot take these names
+RESERVED_CHANNELS = {'state', 'stream', 'ws', 'batch', 'replay', 'timer', 'countdown', 'visibility', 'message', 'event'}
+MAX_CHANNELS = 64
+CHANNEL_IDLE_TIMEOUT = 30 * 60  # Seconds without clients or commands before a channel is dropped
+CHANNEL_SWEEP_INTERVAL = 60
+MESSAGE_QUEUE_SIZE = 20  # Messages waiting behind the one on screen
+MIN_MESSAGE_DURATION = 1  # Seconds
+MAX_MESSAGE_DURATION = 60 * 60
+MAX_MESSAGE_PRIORITY = 100  # Priorities run from -MAX_MESSAGE_PRIORITY to MAX_MESSAGE_PRIORITY
+EVENT_QUEUE_SIZE = 50  # Events playing or waiting to play
+MAX_EVENT_DURATION = 60  # Seconds, longer effects are cut to this
+MAX_COUNTDOWN_MINUTES = 24 * 60
+
+# Default state
+# Timers are published as start anchors, their value at any time t is
+# base_value + rate * (t - started_at), so they only change on start, stop and reset
+DEFAULT_STATE = {
+    "timer": {
+        "base_value": 0.0,
+        "started_at": time.time(),
+        "rate": 0.0,
+        "running": False,
+        "visible": True
+    },
+    "countdown": {
+        "base_value": 0.0,
+        "started_at": time.time(),
+        "rate": 0.0,
+        "initial": 0.0,
+        "running": False,
+        "visible": True
+    },
+    # The message on screen, followed by the waiting ones in the order they will be shown
+    "message": {
+        "text": "",
+        "color": "#b71c1c",
+        "expires_at": 0.0,
+        "queue": []
+    },
+    # Effects play one after another, each display plays every event id once
+    "event": {
+        "next_id": 1,
+        "timeline": []
+    }
+}
+
+# An immutable published state: epoch and version (sent together as the ETag of /api/state and the id
+# of stream frames), the state dict, its JSON and the recent change log
+# Versions count from 0 again whenever a channel starts without saved state (a restart, a channel
+# created again after it was dropped), the epoch names each such run so its versions are never mixed up
+StateSnapshot = namedtuple('StateSnapshot', ['epoch', 'version', 'state', 'frame', 'changes'])
+
+def new_epoch():
+    return secrets.token_hex(4)
+
+def state_tag(snapshot):
+    """ETag of /api/state and id of stream frames: the version together with its epoch"""
+    return f'{snapshot.epoch}-{snapshot.version}'
+
+def encode_state(state):
+    """
+    JSON frame of a state, refusing NaN and infinity with ValueError
+    The pages could not parse them, and the timers armed from them would fail
+    """
+    return json.dumps(state, allow_nan=False)
+
+def diff_state(old, new):
+    """Fields of each state section that differ between two states"""
+    changes = {}
+    for section, fields in new.items():
+        changed = {key: value for key, value in fields.items() if old[section].get(key) != value}
+        if changed:
+            changes[section] = changed
+    return changes
+
+def offer(client, item):
+    """Queue an item for one client, dropping its oldest item if it is falling behind"""
+    while True:
+        try:
+            client.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                client.get_nowait()
+            except queue.Empty:
+                pass
+
+class StateStore:
+    def __init__(self, name=DEFAULT_CHANNEL, journal=None, recorder=None, backend=None, lock=None):
+        self.name = name
+        self.journal = journal
+        self.recorder = recorder
+        self.backend = backend or MemoryBackend()
+        self.lock = lock or Lock()
+        # Writers build a new snapshot under the lock and swap this reference, readers just take it
+        # Snapshots are never mutated once published, so reading needs no lock
+        self.snapshot = StateSnapshot(new_epoch(), 0, DEFAULT_STATE, encode_state(DEFAULT_STATE), ())
+        # Connected push clients, each with a queue of snapshots
+        self.subscribers = set()
+        self.subscribers_lock = Lock()
+        # Open push connections by transport, one subscriber can serve many of them (async server)
+        self.connections = {'stream': 0, 'websocket': 0}
+        self.countdown_timer = None
+        self.message_timer = None
+        self.last_used = time.monotonic()
+        # A shared backend holds the current state, the local journal is only used without one
+        saved = self.backend.load(name)
+        if journal and saved is None:
+            saved = journal.load(name)
+        if saved:
+            self.restore(*saved)
+        if recorder:
+            recorder.start(self)
+
+    def restore(self, version, saved_state, epoch=None):
+        """
+        Continue from a saved state: timers resume from their anchors at the right wall-clock time,
+        and a countdown or message that ran out while the server was down ends right away
+        A state from the local journal keeps this run's new epoch, as clients may have seen other
+        states under its version numbers, a shared backend passes on the epoch it was saved with
+        """
+        state = copy.deepcopy(DEFAULT_STATE)
+        for section, fields in saved_state.items():
+            # Fields from an older state layout are left out
+            if section in state:
+                state[section].update((key, value) for key, value in fields.items() if key in state[section])
+        # A number that is not finite, saved before commands were checked, falls back to its default
+        for section, fields in state.items():
+            for key, value in fields.items():
+                if isinstance(value, float) and not math.isfinite(value):
+                    fields[key] = DEFAULT_STATE[section][key]
+        # Effects saved before durations were capped would hold up the ones after them
+        for entry in state['event']['timeline']:
+            if not entry['duration'] <= MAX_EVENT_DURATION:
+                entry['duration'] = MAX_EVENT_DURATION
+        with self.lock:
+            self._replace(version, state, epoch=epoch)
+
+    def _replace(self, version, state, changes=None, epoch=None):
+        """Make a state from disk or another process the current snapshot, and return it (caller holds the lock)"""
+        current = self.snapshot
+        epoch = epoch or current.epoch
+        if changes is not None and epoch == current.epoch and version == current.version + 1:
+            change_log = (current.changes + ((version, changes),))[-CHANGE_LOG_SIZE:]
+        else:
+            change_log = ()  # Clients asking for a delta across the gap get the full state
+        self.snapshot = StateSnapshot(epoch, version, state, encode_state(state), change_log)
+        self._schedule_countdown_end(state['countdown'])
+        self._schedule_message_end(state['message'])
+        return self.snapshot
+
+    def _refresh(self):
+        """Take over a newer version another process saved to the backend (caller holds the lock)"""
+        saved = self.backend.load(self.name)
+        if saved and saved[0] > self.snapshot.version:
+            version, state, epoch = saved
+            self._replace(version, state, epoch=epoch)
+            if self.recorder:
+                self.recorder.append(self, version, None)
+        return self.snapshot
+
+    def refresh(self):
+        """Catch up with the backend after changes from other processes may have been missed"""
+        with self.lock:
+            before = self.snapshot
+            current = self._refresh()
+        if current is not before:
+            self.publish(current)
+
+    def current(self):
+        """
+        The snapshot to answer a read with, after taking over a newer version another process saved
+        The backend's listener would catch up a moment later, but a client that just sent a command
+        through another worker must not get the version from before it
+        """
+        saved = self.backend.newer(self.name, self.snapshot.version)
+        if saved:
+            self.apply_remote(*saved)
+        return self.snapshot
+
+    def apply_remote(self, version, state, changes, epoch=None):
+        """Publish a version another process saved, the countdown and message timers follow it"""
+        with self.lock:
+            if version <= self.snapshot.version:
+                return  # Our own change coming back, or one we already loaded
+            previous = self.snapshot
+            snapshot = self._replace(version, state, changes, epoch)
+            # Every process records the whole timeline, including the changes made by the others
+            # Across a gap the changes would not rebuild the state, a keyframe is recorded instead
+            if self.recorder:
+                contiguous = version == previous.version + 1 and snapshot.epoch == previous.epoch
+                self.recorder.append(self, version, changes if contiguous else None)
+        self.publish(snapshot)
+
+    @contextmanager
+    def update(self):
+        """
+        Give the caller a private copy of the state to change, then publish it as the next snapshot
+        If the caller raises, the copy is dropped and the published state stays untouched
+        """
+        with self.lock, self.backend.lock(self.name):
+            before = self.snapshot
+            current = self._refresh()
+            if current is not before:
+                # Pass on a version from another process even if this update changes nothing or fails,
+                # its own notification will be ignored as already loaded
+                self.publish(current)
+            draft = copy.deepcopy(current.state)
+            yield draft
+            changes = diff_state(current.state, draft)
+            if not changes:
+                return
+            version = current.version + 1
+            frame = encode_state(draft)
+            change_log = (current.changes + ((version, changes),))[-CHANGE_LOG_SIZE:]
+            # Saved before it is published here, a backend that refuses the state leaves it unchanged
+            self.backend.save(self.name, version, draft, frame, changes, current.epoch)
+            snapshot = self.snapshot = StateSnapshot(current.epoch, version, draft, frame, change_log)
+            if self.journal:
+                self.journal.append(self, version, changes)
+            if self.recorder:
+                self.recorder.append(self, version, changes)
+            if 'countdown' in changes:
+                self._schedule_countdown_end(draft['countdown'])
+            if 'message' in changes:
+                self._schedule_message_end(draft['message'])
+        self.publish(snapshot)
+
+        # Speak a message when it comes on screen, so the audio follows the display
+        # and a failed batch never reads out its message
+        message = draft['message']
+        if 'expires_at' in changes.get('message', {}) and message['text']:
+            speak(message['text'], replace_pending=True)
+
+    def delta(self, since, epoch):
+        """
+        Return (snapshot, changes) where changes merges everything after version since of epoch,
+        or is None when since counts in another epoch or the change log does not reach back that far
+        """
+        current = self.current()
+        if epoch != current.epoch:
+            return current, None
+        if since == current.version:
+            return current, {}
+        if not current.changes or since < current.changes[0][0] - 1 or since > current.version:
+            return current, None
+        merged = {}
+        for version, changes in current.changes:
+            if version > since:
+                for section, fields in changes.items():
+                    merged.setdefault(section, {}).update(fields)
+        return current, merged
+
+    def subscribe(self, client=None):
+        """
+        Register a push client and return its queue of snapshots
+        Anything with a queue's put_nowait (and get_nowait if it can fill up) can stand in
+        """
+        if client is None:
+            client = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        with self.subscribers_lock:
+            self.subscribers.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self.subscribers_lock:
+            self.subscribers.discard(client)
+
+    @contextmanager
+    def connection(self, transport):
+        """Count a display or control panel connected through transport ('stream' or 'websocket') while it is open"""
+        with self.subscribers_lock:
+            self.connections[transport] += 1
+        try:
+            yield
+        finally:
+            with self.subscribers_lock:
+                self.connections[transport] -= 1
+
+    def publish(self, snapshot):
+        """Queue a published snapshot for every push client"""
+        with self.subscribers_lock:
+            for client in self.subscribers:
+                offer(client, snapshot)
+
+    def idle(self, now):
+        """True when no push client is connected and nothing touched the channel for a while"""
+        return not self.subscribers and now - self.last_used > CHANNEL_IDLE_TIMEOUT
+
+    def close(self):
+        """Stop the timers of a channel that is dropped, and let go of it in the backend"""
+        with self.lock:
+            for timer in (self.countdown_timer, self.message_timer):
+                if timer:
+                    timer.cancel()
+            self.countdown_timer = self.message_timer = None
+        self.backend.release(self.name)
+
+    def _schedule_countdown_end(self, countdown):
+        """Arm a timer that stops the countdown when it reaches zero (caller holds the lock)"""
+        if self.countdown_timer:
+            self.countdown_timer.cancel()
+            self.countdown_timer = None
+        if countdown['running']:
+            remaining = timer_value(countdown, time.time())
+            self.countdown_timer = Timer(remaining, self._finish_countdown, args=(countdown['started_at'],))
+            self.countdown_timer.daemon = True
+            self.countdown_timer.start()
+
+    def _finish_countdown(self, started_at):
+        with self.update() as state:
+            countdown = state['countdown']
+            # Ignore a timer that fired after the countdown was restarted or stopped
+            if countdown['running'] and countdown['started_at'] == started_at:
+                set_anchor(countdown, 0.0, 0.0, time.time())
+
+    def _schedule_message_end(self, message):
+        """Arm a timer that brings up the next queued message when this one expires (caller holds the lock)"""
+        if self.message_timer:
+            self.message_timer.cancel()
+            self.message_timer = None
+        if message['text']:
+            remaining = max(0.0, message['expires_at'] - time.time())
+            self.message_timer = Timer(remaining, self._finish_message, args=(message['expires_at'],))
+            self.message_timer.daemon = True
+            self.message_timer.start()
+
+    def _finish_message(self, expires_at):
+        with self.update() as state:
+            message = state['message']
+            # Ignore a timer that fired after the message was cleared or skipped
+            if message['text'] and message['expires_at'] == expires_at:
+                next_message(message, time.time())
+
+class ChannelRegistry:
+    """
+    Named channels, each a StateStore with its own lock and subscribers
+    Channels are created on first use and dropped once idle, the default channel is kept
+    With persistence on, a channel is restored from disk when it is created
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.channels = {}
+        self.journal = None
+        self.recorder = None
+        self.backend = MemoryBackend()
+        self.lock_factory = Lock
+        self.last_sweep = time.monotonic()
+
+    def enable_persistence(self, directory):
+        """Save every channel's changes under directory (before the first request)"""
+        self.journal = StateJournal(directory)
+
+    def use_backend(self, backend):
+        """Share channel state through backend instead of keeping it in this process (before the first request)"""
+        self.backend = backend
+
+    def use_lock_factory(self, factory):
+        """Build each channel's state lock with factory, e.g. a lock that is timed (before the first request)"""
+        self.lock_factory = factory
+
+    def enable_recording(self, directory):
+        """Record every channel's changes for replay under directory (before the first request)"""
+        self.recorder = TimelineRecorder(directory)
+
+    def get(self, name):
+        """Return the channel's store, creating it if needed, or None for an unusable name"""
+        now = time.monotonic()
+        if now - self.last_sweep > CHANNEL_SWEEP_INTERVAL:
+            self.evict_idle(now)
+        # Existing channels are looked up without the registry lock
+        channel = self.channels.get(name)
+        if channel is None:
+            if not CHANNEL_NAME.fullmatch(name) or name in RESERVED_CHANNELS:
+                return None
+            with self.lock:
+                channel = self.channels.get(name)
+                if channel is None:
+                    if len(self.channels) >= MAX_CHANNELS:
+                        return None
+                    try:
+                        channel = StateStore(name, self.journal, self.recorder, self.backend, self.lock_factory())
+                    except ChannelLimitError:
+                        return None
+                    self.channels[name] = channel
+                    self.backend.listen(self)
+                    # Pick up a change published after the store loaded but before the listener could find it
+                    channel.refresh()
+        channel.last_used = now
+        return channel
+
+    def evict_idle(self, now):
+        with self.lock:
+            self.last_sweep = now
+            idle = [name for name, channel in self.channels.items()
+                    if name != DEFAULT_CHANNEL and channel.idle(now)]
+            evicted = [self.channels.pop(name) for name in idle]
+        for channel in evicted:
+            channel.close()
+
+def timer_value(part, current_time):
+    """Value of the timer or countdown at current_time, computed from its start anchor"""
+    value = part['base_value'] + part['rate'] * (current_time - part['started_at'])
+    return max(0.0, value)
+
+def set_anchor(part, value, rate, current_time):
+    part['base_value'] = value
+    part['rate'] = rate
+    part['started_at'] = current_time
+    part['running'] = rate != 0
+
+# Commands shared by the HTTP routes and the WebSocket channel
+# Each one changes the draft state handed out by StateStore.update()
+def number_in_range(data, key, default, low, high, kind=float):
+    """
+    data[key] converted with kind, raising ValueError unless it lies from low to high
+    Every numeric command field goes through here, so HTTP, WebSocket and batch commands refuse the same values
+    """
+    raw = data.get(key, default)
+    # JSON true and false would otherwise pass as 1 and 0
+    if isinstance(raw, bool):
+        raise ValueError(f"{key} must be a number")
+    try:
+        value = kind(raw)
+    except (ValueError, TypeError, OverflowError):
+        raise ValueError(f"{key} must be a number") from None
+    if isinstance(raw, float) and value != raw and math.isfinite(raw):
+        raise ValueError(f"{key} must be a whole number")
+    # NaN fails every comparison, infinity is refused even where high is unbounded
+    if not (low <= value <= high and math.isfinite(value)):
+        bounds = f"from {low} to {high}" if math.isfinite(high) else f"at least {low}"
+        raise ValueError(f"{key} must be a number {bounds}")
+    return value
+
+def apply_timer(state, action):
+    timer = state['timer']
+    current_time = time.time()
+    if action == 'start':
+        set_anchor(timer, timer_value(timer, current_time), 1.0, current_time)
+    elif action == 'stop':
+        set_anchor(timer, timer_value(timer, current_time), 0.0, current_time)
+    elif action == 'reset':
+        set_anchor(timer, 0.0, 0.0, current_time)
+
+def apply_countdown(state, action, data):
+    countdown = state['countdown']
+    current_time = time.time()
+    if action == 'start':
+        minutes = number_in_range(data, 'minutes', 0, 0, MAX_COUNTDOWN_MINUTES)
+        total_seconds = minutes * 60
+        countdown['initial'] = total_seconds  # Store initial value
+        set_anchor(countdown, total_seconds, -1.0, current_time)
+    elif action == 'stop':
+        set_anchor(countdown, timer_value(countdown, current_time), 0.0, current_time)
+    elif action == 'reset':
+        countdown['initial'] = 0
+        set_anchor(countdown, 0.0, 0.0, current_time)
+
+def apply_visibility(state, element):
+    if element in ['timer', 'countdown']:
+        state[element]['visible'] = not state[element]['visible']
+
+def next_message(message, current_time):
+    """Put the first queued message on screen, or clear the screen when the queue is empty"""
+    if message['queue']:
+        entry = message['queue'].pop(0)
+        message['text'] = entry['text']
+        message['color'] = entry['color']
+        message['expires_at'] = current_time + entry['duration']
+    else:
+        message['text'] = ''
+        message['expires_at'] = 0
+
+def apply_message(state, data):
+    """
+    Queue a message behind those of the same or higher priority, it is shown right away
+    when the screen is free. A message on screen always runs its full duration
+    """
+    message = state['message']
+    current_time = time.time()
+    entry = {
+        'text': data.get('text', ''),
+        'color': data.get('color', '#b71c1c'),
+        'duration': number_in_range(data, 'duration', 5, MIN_MESSAGE_DURATION, MAX_MESSAGE_DURATION),
+        'priority': number_in_range(data, 'priority', 0, -MAX_MESSAGE_PRIORITY, MAX_MESSAGE_PRIORITY, int),
+    }
+    if not entry['text']:
+        return
+    waiting = message['queue']
+    position = next((i for i, queued in enumerate(waiting) if queued['priority'] < entry['priority']), len(waiting))
+    if position >= MESSAGE_QUEUE_SIZE:
+        raise ValueError("Message queue is full")
+    waiting.insert(position, entry)
+    # A full queue makes room by dropping its last, lowest priority message
+    del waiting[MESSAGE_QUEUE_SIZE:]
+    if not (message['text'] and message['expires_at'] > current_time):
+        next_message(message, current_time)
+
+def apply_skip_message(state):
+    """Take the message on screen down early and show the next one"""
+    next_message(state['message'], time.time())
+
+def apply_clear_message(state):
+    """Take the message on screen down and drop every queued message"""
+    state['message']['queue'] = []
+    next_message(state['message'], time.time())
+
+def apply_event(state, data):
+    """Schedule an effect after the ones still playing or waiting, and return its id"""
+    event = state['event']
+    duration = min(number_in_range(data, 'duration', 5, 0, math.inf), MAX_EVENT_DURATION)
+    current_time = time.time()
+    # Events that have finished playing are dropped
+    timeline = [entry for entry in event['timeline'] if entry['starts_at'] + entry['duration'] > current_time]
+    if len(timeline) >= EVENT_QUEUE_SIZE:
+        raise ValueError("Event queue is full")
+    starts_at = current_time
+    if timeline:
+        last = timeline[-1]
+        starts_at = max(current_time, last['starts_at'] + last['duration'])
+    event_id = event['next_id']
+    timeline.append({
+        'id': event_id,
+        'type': data.get('type', ''),
+        'starts_at': starts_at,
+        'duration': duration,
+    })
+    event['timeline'] = timeline
+    event['next_id'] = event_id + 1
+    return event_id
+
+def apply_clear_events(state):
+    """Drop every event, the displays stop the one playing"""
+    state['event']['timeline'] = []
+
+def apply_batch(state, commands):
+    """
+    Apply a list of {"command", "data"} entries to one draft, so they publish as one version
+    Raises ValueError naming the failing entry, the caller's update is then dropped as a whole
+    """
+    if not isinstance(commands, list):
+        raise ValueError("Batch needs a list of commands")
+    for index, entry in enumerate(commands):
+        try:
+            apply_command(state, entry.get('command', ''), entry.get('data') or {})
+        except (ValueError, TypeError, AttributeError) as e:
+            raise ValueError(f"Command {index}: {e}") from e
+
+def apply_command(state, command, data):
+    """Apply a command named like its API path, e.g. 'timer/start' or 'message/clear'"""
+    kind, _, arg = command.partition('/')
+    if kind == 'timer' and arg:
+        apply_timer(state, arg)
+    elif kind == 'countdown' and arg:
+        apply_countdown(state, arg, data)
+    elif kind == 'visibility' and arg:
+        apply_visibility(state, arg)
+    elif kind == 'message' and not arg:
+        apply_message(state, data)
+    elif kind == 'message' and arg == 'clear':
+        apply_clear_message(state)
+    elif kind == 'message' and arg == 'skip':
+        apply_skip_message(state)
+    elif kind == 'event' and not arg:
+        apply_event(state, data)
+    elif kind == 'event' and arg == 'clear':
+        apply_clear_events(state)
+    elif kind == 'batch' and not arg:
+        apply_batch(state, data.get('commands'))
+    else:
+        raise ValueError(f"Unknown command: {command}")
+
+def handle_socket_message(store, raw):
+    """Run one {"id", "command", "data"} WebSocket message on a channel and return the ack to send back"""
+    ack = {'type': 'ack', 'id': None, 'success': True}
+    try:
+        message = json.loads(raw)
+        ack['id'] = message.get('id')
+        with store.update() as state:
+            apply_command(state, message.get('command', ''), message.get('data') or {})
+    except (ValueError, TypeError, AttributeError) as e:
+        ack['success'] = False
+        ack['error'] = str(e)
+    return ack
+
+def state_message(snapshot):
+    """WebSocket message carrying a state frame"""
+    return (f'{{"type": "state", "epoch": "{snapshot.epoch}", "version": {snapshot.version}, '
+            f'"state": {snapshot.frame}}}')
+
+# Global channel registry instance
+channels = ChannelRegistry()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# The modules import each other by name, as they do when main.py runs from this directory
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
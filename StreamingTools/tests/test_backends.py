@@ -0,0 +1,119 @@
+from backends import SHM_NAME_SIZE, SHM_SEQ, SHM_SLOTS, ChannelLimitError, RedisBackend, SharedMemoryBackend
+from state_store import ChannelRegistry, StateStore
+from threading import Thread
+import atexit
+import os
+import pytest
+import time
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# Redis and shared memory backends: locks, change notifications, slot reuse and torn reads
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+@pytest.fixture
+def redis_pair(monkeypatch):
+    """Two backends on one fakeredis server, standing in for two processes"""
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('redis')
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr('redis.Redis.from_url', lambda url: fakeredis.FakeRedis(server=server))
+    return RedisBackend('redis://test'), RedisBackend('redis://test')
+
+def test_redis_lock_excludes_other_processes(redis_pair):
+    first, second = redis_pair
+    # The holder's lock outlives the waiter's patience, so the wait ends in a timeout rather than an expiry
+    second.LOCK_TIMEOUT = 0.2
+    with first.lock('default'):
+        with pytest.raises(TimeoutError):
+            with second.lock('default'):
+                pass
+    with second.lock('default'):
+        pass
+
+def test_redis_change_reaches_other_process(redis_pair):
+    first, second = redis_pair
+    writer, reader = ChannelRegistry(), ChannelRegistry()
+    writer.use_backend(first)
+    reader.use_backend(second)
+    remote = reader.get('default')
+    with writer.get('default').update() as state:
+        state['timer']['visible'] = False
+
+    assert wait_for(lambda: remote.snapshot.version == 1)
+    assert remote.snapshot.state['timer']['visible'] is False
+    assert remote.snapshot.epoch == writer.get('default').snapshot.epoch
+    assert second.load('default')[0] == 1
+
+@pytest.fixture
+def shm():
+    if not hasattr(os, 'fork'):
+        pytest.skip("The shared memory backend needs fcntl")
+    backend = SharedMemoryBackend()
+    yield backend
+    atexit.unregister(backend.remove)
+    backend.remove()
+
+def test_shm_released_slot_is_reused(shm):
+    first = StateStore('first', backend=shm)
+    with first.update() as state:
+        state['timer']['visible'] = False
+    base = shm.slots['first']
+    first.close()
+    assert 'first' not in shm.slots
+    assert not bytes(shm.buffer[base:base + SHM_NAME_SIZE]).strip(b'\0')
+
+    # The freed slot is taken again, and the channel in it starts from a blank state
+    second = StateStore('second', backend=shm)
+    assert shm.slots['second'] == base
+    assert second.snapshot.version == 0
+
+def test_shm_full_table_raises_channel_limit(shm):
+    for index in range(SHM_SLOTS):
+        shm.load(f'channel{index}')
+    with pytest.raises(ChannelLimitError):
+        shm.load('one-more')
+    shm.release('channel0')
+    shm.load('one-more')
+
+def test_shm_read_retries_while_a_write_is_in_progress(shm):
+    store = StateStore('torn', backend=shm)
+    with store.update() as state:
+        state['timer']['visible'] = False
+    base = shm.slots['torn']
+    seq = shm._seq(base)
+    # An odd seq is what readers see while a writer is halfway through the slot
+    SHM_SEQ.pack_into(shm.buffer, base + SHM_NAME_SIZE, seq + 1)
+    results = []
+    reader = Thread(target=lambda: results.append(shm.read('torn')), daemon=True)
+    reader.start()
+    time.sleep(0.05)
+    assert reader.is_alive() and not results
+
+    SHM_SEQ.pack_into(shm.buffer, base + SHM_NAME_SIZE, seq)
+    reader.join(1)
+    version, state, changes, epoch = results[0]
+    assert version == 1 and state['timer']['visible'] is False
+    assert epoch == store.snapshot.epoch
+
+def test_shm_read_sees_version_saved_by_another_worker(shm):
+    # Two stores on one block stand in for two workers, neither listens for changes
+    writer, reader = StateStore('default', backend=shm), StateStore('default', backend=shm)
+    with writer.update() as state:
+        state['timer']['visible'] = False
+    assert reader.snapshot.version == 0
+    current = reader.current()
+    assert current.version == 1 and current.state['timer']['visible'] is False
+    assert current.epoch == writer.snapshot.epoch
+
+    # A delta request catches up the same way, with the change itself
+    with writer.update() as state:
+        state['timer']['visible'] = True
+    assert reader.delta(1, current.epoch) == (reader.snapshot, {'timer': {'visible': True}})
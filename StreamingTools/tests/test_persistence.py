@@ -0,0 +1,38 @@
+from persistence import StateJournal
+import json
+import os
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# Journal replay after a crash
+
+def write_log(directory, entries, tail=b''):
+    with open(os.path.join(directory, 'default.log'), 'wb') as f:
+        for version, changes in entries:
+            f.write(json.dumps({'version': version, 'changes': changes}).encode() + b'\n')
+        f.write(tail)
+
+def test_replay_cuts_a_torn_last_line(tmp_path):
+    write_log(tmp_path, [(1, {'timer': {'running': True}}), (2, {'timer': {'visible': False}})],
+              tail=b'{"version": 3, "changes": {"tim')
+    journal = StateJournal(str(tmp_path))
+    version, state = journal.load('default')
+    assert version == 2
+    assert state == {'timer': {'running': True, 'visible': False}}
+
+    # The torn line is cut off, so the next entry starts on a clean line
+    log_path = os.path.join(tmp_path, 'default.log')
+    with open(log_path, 'rb') as f:
+        assert f.read().endswith(b'}\n')
+    with open(log_path, 'ab') as f:
+        f.write(json.dumps({'version': 3, 'changes': {'timer': {'running': False}}}).encode() + b'\n')
+    assert StateJournal(str(tmp_path)).load('default') == (3, {'timer': {'running': False, 'visible': False}})
+
+def test_replay_skips_entries_in_the_snapshot(tmp_path):
+    with open(os.path.join(tmp_path, 'default.snapshot.json'), 'w') as f:
+        json.dump({'version': 2, 'state': {'timer': {'running': True}}}, f)
+    write_log(tmp_path, [(2, {'timer': {'running': False}}), (3, {'timer': {'visible': False}})])
+    assert StateJournal(str(tmp_path)).load('default') == (3, {'timer': {'running': True, 'visible': False}})
+
+def test_nothing_saved(tmp_path):
+    assert StateJournal(str(tmp_path)).load('default') is None
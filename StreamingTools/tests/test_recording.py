@@ -0,0 +1,56 @@
+from recording import INDEX_ENTRY, Timeline, open_timeline
+import json
+import pytest
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# Seeking recorded sessions through the keyframe index
+
+START = 1000.0
+
+@pytest.fixture
+def timeline(tmp_path):
+    """A session with one record per second and a keyframe every 10 records"""
+    path = str(tmp_path / 'session')
+    with open(path + '.timeline', 'wb') as records, open(path + '.index', 'wb') as index:
+        for version in range(50):
+            recorded_at = START + version
+            if version % 10 == 0:
+                index.write(INDEX_ENTRY.pack(recorded_at, records.tell()))
+                record = {'t': recorded_at, 'v': version, 'state': {'timer': {'value': version}}}
+            else:
+                record = {'t': recorded_at, 'v': version, 'changes': {'timer': {'value': version}}}
+            records.write(json.dumps(record).encode() + b'\n')
+    return Timeline(path)
+
+def keyframe_offset(timeline, position):
+    with open(timeline.path + '.index', 'rb') as f:
+        return timeline._entry(f, position)[1]
+
+def test_seek_before_first_keyframe(timeline):
+    assert timeline.seek(START - 100) == keyframe_offset(timeline, 0)
+    recorded_at, version, state = next(timeline.play(START - 100))
+    assert (recorded_at, version, state) == (START, 0, {'timer': {'value': 0}})
+
+def test_seek_between_keyframes(timeline):
+    assert timeline.seek(START + 25.5) == keyframe_offset(timeline, 2)
+    assert timeline.seek(START + 30) == keyframe_offset(timeline, 3)
+    recorded_at, version, state = next(timeline.play(START + 25.5))
+    assert (recorded_at, version, state) == (START + 25.5, 25, {'timer': {'value': 25}})
+
+def test_seek_after_last_record(timeline):
+    assert timeline.seek(START + 500) == keyframe_offset(timeline, 4)
+    frames = list(timeline.play(START + 500))
+    assert frames == [(START + 500, 49, {'timer': {'value': 49}})]
+    assert timeline.end() == START + 49
+
+def test_keyframes_past_the_written_records_are_left_out(tmp_path, timeline):
+    # A keyframe indexed before a crash kept its record from reaching the disk, and a torn entry
+    with open(timeline.path + '.index', 'ab') as index:
+        index.write(INDEX_ENTRY.pack(START + 50, 10 ** 9) + b'\0\0\0')
+    reopened = Timeline(timeline.path)
+    assert reopened.keyframes == 5
+    assert reopened.end() == START + 49
+
+def test_open_timeline_refuses_other_names(tmp_path):
+    assert open_timeline(str(tmp_path), 'default', '../secret') is None
@@ -0,0 +1,46 @@
+from tts import TTSManager
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# The TTS pipeline with the decoded audio cache, without Google TTS or a sound card
+
+class FakeAudio:
+    raw_data = bytes(4800)
+
+def build_manager():
+    calls = {'synthesize': [], 'decode': 0, 'play': 0}
+
+    def synthesize(text, lang, tld):
+        calls['synthesize'].append(lang)
+        return b'mp3'
+
+    def decode(mp3):
+        calls['decode'] += 1
+        return FakeAudio()
+
+    def play(audio):
+        calls['play'] += 1
+
+    manager = TTSManager(synthesizer=synthesize, decoder=decode, player=play)
+    manager.enable_cache(2**20, decoded_bytes=2**20)
+    stages = []
+    manager.stage_hooks.append(lambda stage, seconds: stages.append(stage))
+    return manager, calls, stages
+
+def test_repeat_skips_detection_and_decode():
+    manager, calls, stages = build_manager()
+    manager._speak("Danke für das Abo, viel Spaß beim Zuschauen")
+    assert 'detect' in stages and calls['synthesize'] == ['de']
+    stages.clear()
+
+    manager._speak("Danke für das Abo, viel Spaß beim Zuschauen 🎉")
+    assert stages == ['clean', 'cache', 'play']
+    assert calls == {'synthesize': ['de'], 'decode': 1, 'play': 2}
+    assert manager.cache.decoded_hits == 1
+
+def test_explicit_language_is_its_own_entry():
+    manager, calls, stages = build_manager()
+    manager._speak("Merci beaucoup pour le raid", lang='en')
+    assert 'detect' not in stages and calls['synthesize'] == ['en']
+    manager._speak("Merci beaucoup pour le raid")
+    assert calls['synthesize'] == ['en', 'fr'] and calls['decode'] == 2
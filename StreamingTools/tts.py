@@ -1,29 +1,58 @@
 from gtts import gTTS
 from pydub import AudioSegment
 from pydub.playback import play
-from threading import Thread
+from contextlib import contextmanager
+from threading import Lock, Thread
+from tts_cache import AudioCache
 import queue
 import io
-import os
-import tempfile
+import time
 
 # REDLIX Streaming Tools
 ### This File is Part of StreamingTools Alpha v.1.0. 
 # TTS Module from 30.10.2025
 
+def gtts_synthesize(text, lang, tld):
+    """MP3 of the text from Google TTS"""
+    buffer = io.BytesIO()
+    gTTS(text=text, lang=lang, tld=tld, slow=False).write_to_fp(buffer)
+    return buffer.getvalue()
+
+def decode_mp3(mp3):
+    """Decode MP3 bytes, pydub hands them to ffmpeg through a pipe instead of a file"""
+    return AudioSegment.from_file(io.BytesIO(mp3), format='mp3')
+
 class TTSManager:
-    def __init__(self):
+    """
+    Speaks queued texts one after another on a worker thread
+    The pipeline can be swapped, e.g. for benchmarks: synthesizer(text, lang, tld) returns MP3 bytes,
+    decoder(mp3) decodes those bytes and player(audio) plays the result
+    """
+    def __init__(self, synthesizer=gtts_synthesize, decoder=decode_mp3, player=play):
+        self.synthesizer = synthesizer
+        self.decoder = decoder
+        self.player = player
         self.tts_queue = queue.Queue()
         self.running = False
         self.worker_thread = None
         self.default_language = 'fr'  # Default language fallback
         self.tld = 'fr'  # French accent, ui ui Baguette Paris Croissant
-        self._start_worker()
+        self.worker_lock = Lock()
+        self.cache = None  # AudioCache of synthesized texts, see enable_cache
+        # Called with (stage, seconds) after each stage of speaking a text:
+        # clean, detect, cache (the lookup), synthesize, decode, play
+        self.stage_hooks = []
+        # Called with (text, error) when a text could not be spoken
+        self.failure_hooks = []
     
     def _start_worker(self):
-        """Start the worker thread for processing TTS queue"""
+        """
+        Start the worker thread for processing TTS queue
+        Started on the first message rather than on import, so a reloader parent or a
+        pre-fork server master never runs a worker of its own
+        """
         self.running = True
-        self.worker_thread = Thread(target=self._process_queue, daemon=True)
+        self.worker_thread = Thread(target=self._process_queue, name='tts-worker', daemon=True)
         self.worker_thread.start()
     
     def _process_queue(self):
@@ -31,9 +60,9 @@ class TTSManager:
         while self.running:
             try:
                 # Get text from queue with timeout
-                text = self.tts_queue.get(timeout=1)
+                text, lang = self.tts_queue.get(timeout=1)
                 if text:
-                    self._speak(text)
+                    self._speak(text, lang)
                 self.tts_queue.task_done()
             except queue.Empty:
                 continue
@@ -43,44 +72,70 @@ class TTSManager:
     def _detect_language(self, text):
         """Detect the language of the text"""
         try:
-            from langdetect import detect
+            from langdetect import DetectorFactory, detect
+            # langdetect samples randomly, a fixed seed gives a repeated text the same cache key
+            DetectorFactory.seed = 0
             detected_lang = detect(text)
             return detected_lang
         except:
             # Fall back to default language if detection fails
             return self.default_language
     
-    def _speak(self, text):
-        """Actually speak the text using Google TTS"""
+    @contextmanager
+    def _stage(self, stage):
+        """Time one stage of speaking a text for the stage hooks"""
+        started = time.perf_counter()
+        yield
+        for hook in self.stage_hooks:
+            hook(stage, time.perf_counter() - started)
+    
+    def _speak(self, text, lang=None):
+        """Actually speak the text using Google TTS, in lang or else the detected language"""
         try:
             # Clean the text
-            cleaned_text = self._clean_text(text)
+            with self._stage('clean'):
+                cleaned_text = self._clean_text(text)
             if not cleaned_text:
                 return
             
-            # Detect language automatically
-            detected_lang = self._detect_language(cleaned_text)
-            
-            # Generate speech using gTTS with detected language and French accent
-            tts = gTTS(text=cleaned_text, lang=detected_lang, tld=self.tld, slow=False)
+            # Decoded audio is kept under the language asked for, so a repeat is found before
+            # langdetect runs; detection is seeded, the same text always gets the same language
+            requested_lang = lang or f'auto:{self.default_language}'
+            mp3 = audio = None
+            if self.cache:
+                with self._stage('cache'):
+                    audio = self.cache.get_decoded(cleaned_text, requested_lang, self.tld)
             
-            # Save to a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as fp:
-                temp_file = fp.name
-                tts.save(temp_file)
-            
-            # Load and play the audio
-            audio = AudioSegment.from_mp3(temp_file)
-            play(audio)
+            if audio is None:
+                # Detect language automatically
+                if lang is None:
+                    with self._stage('detect'):
+                        lang = self._detect_language(cleaned_text)
+                
+                if self.cache:
+                    with self._stage('cache'):
+                        mp3 = self.cache.get(cleaned_text, lang, self.tld)
+                
+                # Generate speech with detected language and French accent
+                if mp3 is None:
+                    with self._stage('synthesize'):
+                        mp3 = self.synthesizer(cleaned_text, lang, self.tld)
+                    if self.cache:
+                        self.cache.put(cleaned_text, lang, self.tld, mp3)
+                
+                # Decode in memory, nothing touches the disk
+                with self._stage('decode'):
+                    audio = self.decoder(mp3)
+                if self.cache:
+                    self.cache.put_decoded(cleaned_text, requested_lang, self.tld, audio)
             
-            # Clean up temporary file
-            try:
-                os.unlink(temp_file)
-            except:
-                pass
+            with self._stage('play'):
+                self.player(audio)
                 
         except Exception as e:
             print(f"Error speaking text: {e}")
+            for hook in self.failure_hooks:
+                hook(text, e)
     
     def _clean_text(self, text):
         """Clean text by removing emojis and special characters"""
@@ -100,10 +155,30 @@ class TTSManager:
         cleaned = ' '.join(cleaned.split())
         return cleaned.strip()
     
-    def speak_async(self, text):
-        """Add text to the TTS queue for async speaking"""
+    def speak_async(self, text, replace_pending=False, lang=None):
+        """
+        Add text to the TTS queue for async speaking, in lang or else the detected language
+        With replace_pending, texts still waiting are dropped so this one is spoken next
+        """
         if text and text.strip():
-            self.tts_queue.put(text)
+            with self.worker_lock:
+                if not (self.worker_thread and self.worker_thread.is_alive()):
+                    self._start_worker()
+            if replace_pending:
+                while True:
+                    try:
+                        self.tts_queue.get_nowait()
+                        self.tts_queue.task_done()
+                    except queue.Empty:
+                        break
+            self.tts_queue.put((text, lang))
+    
+    def enable_cache(self, memory_bytes, directory=None, disk_bytes=0, decoded_bytes=0):
+        """
+        Keep synthesized texts in memory, and under directory if given, so repeats skip Google TTS
+        With decoded_bytes, the decoded audio of recent texts is kept too, so their repeats skip the decode
+        """
+        self.cache = AudioCache(memory_bytes, directory, disk_bytes, decoded_bytes)
     
     def set_language(self, lang='de', tld='fr'):
         """
@@ -123,9 +198,9 @@ class TTSManager:
 # Global TTS manager instance
 tts_manager = TTSManager()
 
-def speak(text):
+def speak(text, replace_pending=False, lang=None):
     """Convenience function to speak text"""
-    tts_manager.speak_async(text)
+    tts_manager.speak_async(text, replace_pending, lang)
 
 def set_voice(language='fr', accent='fr'):
     """Convenience function to change default fallback language (accent is always French)"""
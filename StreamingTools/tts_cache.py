@@ -0,0 +1,169 @@
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import os
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# Cache of synthesized speech, so repeated texts are played without asking Google TTS again
+
+class AudioCache:
+    """
+    MP3 by (cleaned text, language, tld), in memory and optionally on disk
+    Each tier is bounded by its total bytes and drops the least recently used entries first
+    Disk entries are named by the hash of their key, so server processes sharing the directory share entries
+    With decoded_bytes, the decoded audio (PCM) of recent texts is kept as well, so a repeat skips the decode
+    TTSManager keys decoded audio on the language asked for ('auto:<fallback>' when it is detected)
+    """
+    def __init__(self, memory_bytes, directory=None, disk_bytes=0, decoded_bytes=0):
+        self.lock = Lock()
+        self.memory_bytes = memory_bytes
+        self.memory = OrderedDict()  # Key -> MP3, least recently used first
+        self.memory_used = 0
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.disk = OrderedDict()  # Key -> file size, least recently used first
+        self.disk_used = 0
+        self.decoded_bytes = decoded_bytes
+        self.decoded = OrderedDict()  # Key -> AudioSegment, least recently used first
+        self.decoded_used = 0
+        self.decoded_hits = 0  # Lookups that found the decoded audio, not counted in hits
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def key(text, lang, tld):
+        return hashlib.sha256(f'{lang}\0{tld}\0{text}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.mp3')
+
+    def _scan_disk(self):
+        """Index the files left by earlier runs, oldest use first"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.mp3'):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, name[:-len('.mp3')], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_used += size
+        self._evict_disk()
+
+    def get(self, text, lang, tld):
+        """The cached MP3, or None"""
+        key = self.key(text, lang, tld)
+        with self.lock:
+            mp3 = self.memory.get(key)
+            if mp3 is not None:
+                self.memory.move_to_end(key)
+            elif self.directory:
+                mp3 = self._read_disk(key)
+                if mp3 is not None:
+                    self._remember(key, mp3)
+            if mp3 is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return mp3
+
+    def get_decoded(self, text, lang, tld):
+        """The cached decoded audio, or None without counting a miss, get() follows"""
+        if not self.decoded_bytes:
+            return None
+        key = self.key(text, lang, tld)
+        with self.lock:
+            audio = self.decoded.get(key)
+            if audio is not None:
+                self.decoded.move_to_end(key)
+                self.decoded_hits += 1
+            return audio
+
+    def put_decoded(self, text, lang, tld, audio):
+        size = len(audio.raw_data)
+        if size > self.decoded_bytes:
+            return
+        key = self.key(text, lang, tld)
+        with self.lock:
+            previous = self.decoded.pop(key, None)
+            if previous is not None:
+                self.decoded_used -= len(previous.raw_data)
+            self.decoded[key] = audio
+            self.decoded_used += size
+            while self.decoded_used > self.decoded_bytes:
+                _, dropped = self.decoded.popitem(last=False)
+                self.decoded_used -= len(dropped.raw_data)
+
+    def put(self, text, lang, tld, mp3):
+        key = self.key(text, lang, tld)
+        with self.lock:
+            self._remember(key, mp3)
+            if self.directory:
+                self._write_disk(key, mp3)
+
+    def _remember(self, key, mp3):
+        if len(mp3) > self.memory_bytes:
+            return
+        previous = self.memory.pop(key, None)
+        if previous is not None:
+            self.memory_used -= len(previous)
+        self.memory[key] = mp3
+        self.memory_used += len(mp3)
+        while self.memory_used > self.memory_bytes:
+            _, dropped = self.memory.popitem(last=False)
+            self.memory_used -= len(dropped)
+
+    def _read_disk(self, key):
+        # Looked up by path rather than in the index, another process may have written it
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                mp3 = f.read()
+            os.utime(path)  # The modification time orders the entries across restarts
+        except OSError:
+            self._forget_disk(key)
+            return None
+        self._forget_disk(key)
+        self.disk[key] = len(mp3)
+        self.disk_used += len(mp3)
+        return mp3
+
+    def _write_disk(self, key, mp3):
+        if len(mp3) > self.disk_bytes:
+            return
+        path = self._path(key)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(mp3)
+            # Readers never see a half written file
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error caching TTS audio: {e}")
+            return
+        self._forget_disk(key)
+        self.disk[key] = len(mp3)
+        self.disk_used += len(mp3)
+        self._evict_disk()
+
+    def _forget_disk(self, key):
+        size = self.disk.pop(key, None)
+        if size is not None:
+            self.disk_used -= size
+
+    def _evict_disk(self):
+        while self.disk_used > self.disk_bytes:
+            key, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass  # Already removed by another process
@@ -0,0 +1,68 @@
+from state_store import STREAM_KEEPALIVE
+import os
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None  # gunicorn is not available on Windows, waitress is used there
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+# REDLIX Streaming Tools
+### This File is Part of StreamingTools Alpha v.1.0.
+# Production WSGI server mode, without the Flask reloader and the Werkzeug debugger
+
+if BaseApplication:
+    class GunicornServer(BaseApplication):
+        """Runs an already imported app under gunicorn with options from the command line"""
+        def __init__(self, app, options):
+            self.application = app
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+def push_client_limit(threads, requested=None):
+    """
+    Streams and WebSockets one worker may hold, each of them takes a thread until it closes
+    A quarter of the threads (at least 2) stays free for commands and polling
+    """
+    limit = threads - max(2, threads // 4) if requested is None else requested
+    return max(0, min(limit, threads - 1))
+
+def run(app, host, port, threads=32, workers=1, keep_alive=5, backlog=2048, shared_state=False):
+    """
+    Serve the app with gunicorn, or with waitress where gunicorn is missing
+    Every open /api/stream or /api/ws client holds one thread, the app refuses those past
+    push_client_limit(threads), so size threads for the push clients
+    """
+    if workers > 1 and not shared_state:
+        print(f"Warning: state lives in each process, {workers} workers will not share timers and messages "
+              "unless they use --backend shm or redis")
+
+    if BaseApplication and os.name != 'nt':
+        GunicornServer(app, {
+            'bind': f'{host}:{port}',
+            'workers': workers,
+            'threads': threads,
+            'worker_class': 'gthread',
+            'keepalive': keep_alive,
+            'backlog': backlog,
+        }).run()
+    elif waitress:
+        if workers > 1:
+            print("Warning: waitress runs a single process, ignoring --workers")
+        # waitress closes idle connections after channel_timeout, which has to outlast
+        # the keep-alive comments on idle streams
+        waitress.serve(app, host=host, port=port, threads=threads, backlog=backlog,
+                       channel_timeout=max(keep_alive, STREAM_KEEPALIVE * 2))
+    else:
+        raise SystemExit("The production server needs gunicorn or waitress: pip install gunicorn (or waitress on Windows)")